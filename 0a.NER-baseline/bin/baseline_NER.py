@@ -2,94 +2,125 @@
 
 import os, sys
 import json
-from xml.dom.minidom import parse
-import spacy
 
 from drug_index import *
 
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+from analyzer import create_analyzer
+from corpus import read_sentences
+from alignment import TokenAlignment, offset_string
+import profiler
+
 ## --------- Entity extractor ----------- 
 ## -- Extract drug entities from given text and return them as
 ## -- a list of dictionaries with keys "offset", "text", and "type"
 
 def extract_entities(stext, tokens, index) :
     result = []
-    i = 0
-    while i < len(tokens) :
-        # check if a drug name starts at position i
-        drug_type, end = index.find_drug(tokens, i)
-
-        if drug_type is not None :
-            entity_start = tokens[i].idx
-            entity_end = tokens[end].idx + len(tokens[end].text)
-            e = { "offset" : str(entity_start)+"-"+str(entity_end-1),
-                  "text" : stext[entity_start:entity_end],
-                  "type" : drug_type
-                 }
-            result.append(e)
-            i = end
-        
-        i += 1
+    alignment = TokenAlignment.from_tokens(tokens)
+    # leftmost-longest drug names in the sentence, in one pass
+    for first, last, drug_type in index.scan(tokens) :
+        entity_start, entity_end = alignment.char_span(first, last)
+        e = { "offset" : offset_string(entity_start, entity_end),
+              "text" : stext[entity_start:entity_end+1],
+              "type" : drug_type
+             }
+        result.append(e)
 
     return result
       
 ## --------- Entity extractor baseline ----------- 
-def NER_baseline(datafile, drugindex, outfile) :
+def NER_baseline(datafile, drugindex, outfile, batch_size=64, n_process=1, tokenizer="trf", cachedir=None,
+                 fuzzy=0, fuzzy_budget=None) :
     outf = open(outfile, "w")
     
-    index = DrugIndex(drugindex)
-
-    # create tokenizer
-    nlp = spacy.load("en_core_web_trf", disable=["parser"])
-
-    # parse XML file, obtaining a DOM tree
-    tree = parse(datafile)
+    with profiler.stage("load index") :
+        index = DrugIndex(drugindex)
+    # tokens not in the index may be matched approximately, up to 'fuzzy'
+    # edits away, spending at most fuzzy_budget seconds per sentence
+    if fuzzy > 0 :
+        with profiler.stage("build fuzzy index") :
+            index.enable_fuzzy(fuzzy, fuzzy_budget)
+
+    # create tokenizer (see util/analyzer.py for available ones). If a cache
+    # directory is given, sentences analyzed in previous runs are reused
+    nlp = create_analyzer(tokenizer, cachedir)
+
+    # get id and text of each sentence in the file
+    with profiler.stage("parse XML") :
+        sentences = [(s.id, s.text) for s in read_sentences(datafile)]
+
+    # tokenize texts with spacy tokenizer, in batches. Analyzers may
+    # be lazy, so time also the production of each sentence
+    with profiler.stage("analysis") :
+        docs = nlp.pipe((stext for _,stext in sentences),
+                        batch_size=batch_size, n_process=n_process)
+    docs = profiler.timed_iter("analysis", docs)
 
     # process each sentence in the file
-    sentences = tree.getElementsByTagName("sentence")
     length = len(sentences)
     i = 0
-    for s in sentences :
+    for (sid,stext),tokens in zip(sentences, docs) :
         i += 1
-        
-        sid = s.attributes["id"].value   # get sentence id
-        stext = s.attributes["text"].value   # get sentence text
         print(f"{(i/length)*100}% processing sentence {sid}        \r", end="")
 
-        # tokenize text with spacy tokenizer
-        tokens = nlp(stext)
         # extract entities in text
-        entities = extract_entities(stext, tokens, index)
+        with profiler.stage("index lookup") :
+            entities = extract_entities(stext, tokens, index)
 
         # print sentence entities in format requested for evaluation
-        for e in entities :
-            print(sid,
-                  e["offset"],
-                  e["text"],
-                  e["type"],
-                  sep = "|",
-                  file = outf)
+        with profiler.stage("write") :
+            for e in entities :
+                print(sid,
+                      e["offset"],
+                      e["text"],
+                      e["type"],
+                      sep = "|",
+                      file = outf)
 
     outf.close()
 
 
 ## --------- MAIN PROGRAM ----------- 
 ## --
-## -- Usage:  baseline-NER.py target-dir drug_index
+## -- Usage:  baseline-NER.py [--tokenizer=trf|sm|blank|regex] [--cachedir=DIR] [--profile[=DIR]]
+## --                          [--fuzzy=D [--fuzzy-budget=MS]]
+## --                          datafile drug_index result.out [batch_size [n_process]]
 ## --
 ## -- Extracts Drug NE from all XML files in target-dir
+## -- With --fuzzy=D, tokens not in the index are replaced by the closest
+## -- index token up to D edits away, spending at most MS milliseconds
+## -- per sentence in these approximate lookups
 ## --
 
 if __name__ == "__main__" :
-   if len(sys.argv) != 4 :
-       print(f"usage:  {os.path.basename(__file__)} datafile drug_index  result.out")
+   # separate options (--name=value) from positional arguments
+   options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+   args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
+   if len(args) < 3 :
+       print(f"usage:  {os.path.basename(__file__)} [--tokenizer=trf|sm|blank|regex] [--cachedir=DIR] [--profile[=DIR]] [--fuzzy=D [--fuzzy-budget=MS]] datafile drug_index  result.out [batch_size [n_process]]")
        sys.exit(0)
 
-   datafile = sys.argv[1]
-   drugidx = sys.argv[2]
-   outfile = sys.argv[3]
+   datafile = args[0]
+   drugidx = args[1]
+   outfile = args[2]
+   batch_size = int(args[3]) if len(args)>3 else 64
+   n_process = int(args[4]) if len(args)>4 else 1
+
+   # time each stage, and profile them if a directory is given
+   profiler.enable_from_options(options)
 
    # load previously created index
-   NER_baseline(datafile, drugidx, outfile)
+   with profiler.stage("baseline") :
+       NER_baseline(datafile, drugidx, outfile, batch_size, n_process,
+                    tokenizer=options.get("tokenizer", "trf"),
+                    cachedir=options.get("cachedir"),
+                    fuzzy=int(options.get("fuzzy", 0)),
+                    fuzzy_budget=float(options["fuzzy-budget"])/1000 if "fuzzy-budget" in options else None)
+   profiler.report()
 
 
 
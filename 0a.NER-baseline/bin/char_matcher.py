@@ -0,0 +1,181 @@
+#! /usr/bin/python3
+
+# Dictionary matcher working directly on sentence characters, so the
+# baseline can run without any tokenizer (and without importing spacy).
+#
+# Sentences and drug names are split in the same way into pieces: runs of
+# letters and digits, and single punctuation characters. Whitespace only
+# separates pieces. A name matches where its pieces appear consecutively
+# in the sentence, so matches always start and end at word boundaries.
+#
+# Matching is done left to right, taking the longest name starting at each
+# piece, and going on after it (as DrugIndex.scan does with tokens). For
+# this leftmost-longest, non-overlapping search, an Aho-Corasick automaton
+# is not needed: names can only start at piece boundaries, and the walk
+# from each of them stops as soon as the pieces read are not a prefix of
+# any name, so no failure links are needed.
+
+import os, sys
+import re
+from collections import Counter
+
+from drug_index import DrugIndex
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+from corpus import read_sentences
+from alignment import offset_string
+import profiler
+
+# letter/digit runs, or single characters other than whitespace
+PIECE = re.compile(r"[^\W_]+|[^\w\s]|_")
+# separator of pieces in dictionary keys
+SEP = "\x1f"
+
+
+class CharMatcher :
+
+    ## --------------------------------------------------
+    ## Constructor: collect names in given DrugIndex
+    ## --------------------------------------------------
+    def __init__(self, index) :
+        # name (pieces joined by SEP) -> drug type
+        self.names = {}
+        # proper prefixes of names, at piece boundaries
+        self.prefixes = set()
+
+        # pieces of each token in the index vocabulary
+        tokens = [PIECE.findall(index.token(i).decode("utf-8")) for i in range(len(index.vocab_ptr)-1)]
+        child_ptr = index.child_ptr.tolist()
+        child_tok = index.child_tok.tolist()
+        child_node = index.child_node.tolist()
+        node_kind = index.node_kind.tolist()
+
+        # walk the token trie, computing the key of each node
+        stack = [(0, None)]
+        while stack :
+            node, key = stack.pop()
+            if node_kind[node] >= 0 : self.names.setdefault(key, index.kinds[node_kind[node]])
+            for k in range(child_ptr[node], child_ptr[node+1]) :
+                ckey = key
+                for p in tokens[child_tok[k]] :
+                    if ckey is not None : self.prefixes.add(ckey)
+                    ckey = p if ckey is None else ckey + SEP + p
+                stack.append((child_node[k], ckey))
+
+    ## --------------------------------------------------
+    ## find drug names in a text. Return a list of (start, end, type)
+    ## with character offsets, end included
+    ## --------------------------------------------------
+    def match(self, text) :
+        # pieces are lowercased one by one, so offsets are not changed
+        pieces = [(m.start(), m.end(), m.group().lower()) for m in PIECE.finditer(text)]
+        found = []
+        i = 0
+        while i < len(pieces) :
+            best = None
+            key = pieces[i][2]
+            j = i
+            while True :
+                kind = self.names.get(key)
+                if kind is not None : best = (j, kind)
+                if j+1 == len(pieces) or key not in self.prefixes : break
+                j += 1
+                key += SEP + pieces[j][2]
+
+            if best is not None :
+                last, kind = best
+                found.append((pieces[i][0], pieces[last][1]-1, kind))
+                i = last
+            i += 1
+        return found
+
+
+## --------- Entity extractor baseline -----------
+## -- Same as NER_baseline, but with the character matcher
+## -- instead of a tokenizer and the token index lookup.
+## -- An already built matcher may be given instead of the index file
+
+def NER_char_baseline(datafile, drugindex, outfile, matcher=None) :
+    if matcher is None :
+        with profiler.stage("load index") :
+            index = DrugIndex(drugindex)
+        with profiler.stage("build matcher") :
+            matcher = CharMatcher(index)
+
+    with profiler.stage("parse XML") :
+        sentences = [(s.id, s.text) for s in read_sentences(datafile)]
+
+    with open(outfile, "w") as outf :
+        for sid,stext in sentences :
+            with profiler.stage("match") :
+                entities = matcher.match(stext)
+            with profiler.stage("write") :
+                for start,end,kind in entities :
+                    print(sid, offset_string(start, end), stext[start:end+1], kind,
+                          sep="|", file=outf)
+
+
+## --------------------------------------------------
+## Compare the entities in two output files (sid|offset|text|type),
+## e.g. from the token and the character matchers. Print how many
+## are found by both (with the same type or not), and by only one.
+## If show is True, list the differences too.
+## --------------------------------------------------
+def agreement(file1, file2, show=False, outf=sys.stdout) :
+    def load(fname) :
+        with open(fname, encoding="utf-8") as f :
+            return {(sid,offset) : (text,kind)
+                    for sid,offset,text,kind in (line.rstrip("\n").split("|") for line in f if line.strip())}
+    e1, e2 = load(file1), load(file2)
+
+    both = e1.keys() & e2.keys()
+    same = [k for k in both if e1[k][1] == e2[k][1]]
+    only1 = sorted(e1.keys() - e2.keys())
+    only2 = sorted(e2.keys() - e1.keys())
+
+    print(f"{os.path.basename(file1)}: {len(e1)} entities, {os.path.basename(file2)}: {len(e2)} entities", file=outf)
+    print(f"same span and type   {len(same):>7}", file=outf)
+    print(f"same span, diff type {len(both)-len(same):>7}", file=outf)
+    print(f"only in first        {len(only1):>7}", file=outf)
+    print(f"only in second       {len(only2):>7}", file=outf)
+    total = len(e1) + len(e2)
+    print(f"agreement            {100*2*len(same)/total if total else 100.0:>6.1f}%", file=outf)
+
+    # most frequent disagreements
+    for name,only,ents in [("first", only1, e1), ("second", only2, e2)] :
+        common = Counter(ents[k][0] for k in only).most_common(10)
+        if common : print(f"frequent only in {name}: " + ", ".join(f"{t} ({n})" for t,n in common), file=outf)
+
+    if show :
+        for k in only1 : print("<", *k, *e1[k], sep="|", file=outf)
+        for k in only2 : print(">", *k, *e2[k], sep="|", file=outf)
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  char_matcher.py [--profile[=DIR]] datafile drug_index result.out
+## --         char_matcher.py [--show] compare result1.out result2.out
+## --
+## -- Extracts Drug NE from datafile with the character matcher, or
+## -- prints the agreement between two result files
+## --
+
+if __name__ == "__main__" :
+   # separate options (--name=value) from positional arguments
+   options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+   args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
+   if len(args) != 3 :
+       print(f"usage:  {os.path.basename(__file__)} [--profile[=DIR]] datafile drug_index result.out")
+       print(f"        {os.path.basename(__file__)} [--show] compare result1.out result2.out")
+       sys.exit(0)
+
+   if args[0] == "compare" :
+       agreement(args[1], args[2], show="show" in options)
+   else :
+       profiler.enable_from_options(options)
+       with profiler.stage("char baseline") :
+           NER_char_baseline(args[0], args[1], args[2])
+       profiler.report()
@@ -1,40 +1,57 @@
 
 import os, sys
 import json
-import spacy
+import mmap
+import time
+import hashlib
+from bisect import bisect_left
+
+import numpy
+
+# Drug names are stored in a token trie. Once built (or loaded), the trie
+# is kept in a compact form:
+#    vocabulary   distinct tokens, sorted, concatenated as utf-8 (vocab),
+#                 with the offset of each token (vocab_ptr). A token id is
+#                 its position in the sorted vocabulary
+#    children     CSR table: the children of node n are child_node[k] for
+#                 k in child_ptr[n]..child_ptr[n+1]-1, reached with token
+#                 child_tok[k] (sorted within each node). Node 0 is the root
+#    node_kind    drug type of the name ending at each node (index in kinds),
+#                 or -1 if no name ends there
+#
+# Binary index file: magic line, header length (8 bytes, little endian),
+# JSON header with the kinds and the dtype/offset/length of each array,
+# and the arrays themselves. Arrays are used directly from a memory map
+# of the file, so loading takes no time and memory is shared among
+# processes. Legacy JSON indexes (nested dicts with "END" keys) are
+# still accepted, and converted when loaded.
+
+MAGIC = b"DRUGIDX1\n"
+ARRAYS = ["vocab", "vocab_ptr", "child_ptr", "child_tok", "child_node", "node_kind"]
 
 # ------------------------------------------
 class DrugIndex() :
     def __init__(self, filename=None, resources=None) :
-        
+
         if filename is not None:
-            with open(filename, encoding="utf-8") as f :
-                self.tree = json.load(f)
+            with open(filename, "rb") as f :
+                binary = f.read(len(MAGIC)) == MAGIC
+            if binary :
+                self.load(filename)
+            else :
+                with open(filename, encoding="utf-8") as f :
+                    self.compact(json.load(f))
 
         elif resources is not None :
-            self.tree = {}
-            print("Collecting drugs from HSDB")
-            with open(os.path.join(resources,"HSDB.txt")) as h :
-                n = 0
-                for x in h.readlines() :
-                    tks = x.strip().lower().split()
-                    self.add_drug(self.tree, tks, "drug")
-                    n += 1
-                    if n%11==0 : print(f"{n} lines processed.        \r", end="")
-
-            print("Collecting drugs from DrugBank")
-            with open(os.path.join(resources,"DrugBank.txt"), encoding="utf-8") as h :
-                for x in h.readlines() :
-                    (n,t) = x.strip().lower().split("|")
-                    tks = n.split()
-                    self.add_drug(self.tree, tks, t)
-
-            print("Collecting drugs from drugs-train")
-            with open(os.path.join(resources,"drugs-train.txt")) as h :
-                for x in h.readlines() :
-                    (_,_,n,t) = x.strip().lower().split("|")
-                    tks = n.split()
-                    self.add_drug(self.tree, tks, t)
+            # the same name appears many times (e.g. in drugs-train), keep
+            # it only once, with its last type, as it ends in the tree
+            names = {}
+            for tks,kind in resource_entries(resources) :
+                names[tuple(tks)] = kind
+            tree = {}
+            for tks,kind in names.items() :
+                self.add_drug(tree, tks, kind)
+            self.compact(tree)
         else :
             print("Error: either a filename or a resources file was expected")
             sys.exit(1)
@@ -42,40 +59,326 @@ class DrugIndex() :
 
     # ------------------------------------------
     def add_drug(self, node, tks, kind) :
-        if tks[0] not in node :
-            node[tks[0]] = {}
+        for t in tks :
+            node = node.setdefault(t, {})
+        node["END"] = kind
 
-        if len(tks)==1 :
-            node[tks[0]]["END"] = kind
-        else :
-            self.add_drug(node[tks[0]], tks[1:], kind)
+    # ------------------------------------------
+    # convert a trie of nested dicts into the compact arrays
+    def compact(self, tree) :
+        # sorted vocabulary of all tokens in the trie, and drug types
+        tokens = set()
+        kinds = set()
+        stack = [tree]
+        while stack :
+            node = stack.pop()
+            for t,child in node.items() :
+                if t == "END" :
+                    kinds.add(child)
+                else :
+                    tokens.add(t)
+                    stack.append(child)
+        vocab = sorted(tokens)
+        tid = {t:i for i,t in enumerate(vocab)}
+        self.kinds = sorted(kinds)
+        kid = {k:i for i,k in enumerate(self.kinds)}
+
+        # number nodes in breadth first order, children sorted by token id
+        nodes = [tree]
+        child_ptr = [0]
+        child_tok = []
+        child_node = []
+        node_kind = []
+        for node in nodes :
+            node_kind.append(kid.get(node.get("END"), -1))
+            for t,child in sorted((tid[t],c) for t,c in node.items() if t != "END") :
+                child_tok.append(t)
+                child_node.append(len(nodes))
+                nodes.append(child)
+            child_ptr.append(len(child_tok))
+
+        encoded = [t.encode("utf-8") for t in vocab]
+        self.vocab = b"".join(encoded)
+        self.vocab_ptr = numpy.zeros(len(vocab)+1, dtype=numpy.int64)
+        numpy.cumsum([len(t) for t in encoded], out=self.vocab_ptr[1:])
+        self.child_ptr = numpy.array(child_ptr, dtype=numpy.int32)
+        self.child_tok = numpy.array(child_tok, dtype=numpy.int32)
+        self.child_node = numpy.array(child_node, dtype=numpy.int32)
+        self.node_kind = numpy.array(node_kind, dtype=numpy.int8)
+        # token ids already looked up, and root children table
+        self.found = {}
+        self.root = None
+        self.fuzzy = None
 
     # ------------------------------------------
-    def search_drug(self, tree, tks, i) :
-        
-        if tks[i] in tree :
-            kind = None
-            if i<len(tks)-1 :
-                kind, end = self.search_drug(tree[tks[i]], tks, i+1)
-                
-            if kind is not None :
-                return kind, end
-            elif "END" in tree[tks[i]] :
-                return tree[tks[i]]["END"], i
+    # save compact index to a binary file
+    def save(self, filename) :
+        header = {"kinds" : self.kinds, "arrays" : {}}
+        data = []
+        offset = 0
+        for name in ARRAYS :
+            a = getattr(self, name)
+            buf = a if isinstance(a, bytes) else numpy.ascontiguousarray(a).tobytes()
+            dtype = "bytes" if isinstance(a, bytes) else a.dtype.str
+            length = len(a)
+            header["arrays"][name] = [dtype, offset, length]
+            # keep arrays aligned to 8 bytes
+            pad = -len(buf) % 8
+            data.append(buf + b"\0"*pad)
+            offset += len(buf) + pad
+
+        head = json.dumps(header).encode("utf-8")
+        head += b" " * (-(len(MAGIC) + 8 + len(head)) % 8)
+        with open(filename+".tmp", "wb") as f :
+            f.write(MAGIC)
+            f.write(len(head).to_bytes(8, "little"))
+            f.write(head)
+            for buf in data : f.write(buf)
+        os.replace(filename+".tmp", filename)
+
+    # ------------------------------------------
+    # map a binary index file
+    def load(self, filename) :
+        with open(filename, "rb") as f :
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        hlen = int.from_bytes(self.mm[len(MAGIC):len(MAGIC)+8], "little")
+        start = len(MAGIC) + 8 + hlen
+        header = json.loads(self.mm[len(MAGIC)+8:start])
+        self.kinds = header["kinds"]
+        for name,(dtype,offset,length) in header["arrays"].items() :
+            if dtype == "bytes" :
+                a = memoryview(self.mm)[start+offset:start+offset+length]
+            else :
+                a = numpy.frombuffer(self.mm, dtype=dtype, count=length, offset=start+offset)
+            setattr(self, name, a)
+        self.found = {}
+        self.root = None
+        self.fuzzy = None
+
+    # ------------------------------------------
+    # id of a (lowercased) token, or -1 if it is in no drug name
+    def token_id(self, t) :
+        if t not in self.found :
+            key = t.encode("utf-8")
+            i = bisect_left(_Keys(self), key)
+            self.found[t] = i if i < len(self.vocab_ptr)-1 and self.token(i) == key else -1
+        return self.found[t]
+
+    # ------------------------------------------
+    # approximate lookup index of the vocabulary (see fuzzy_index.py)
+    def fuzzy_index(self, max_distance=1) :
+        from fuzzy_index import FuzzyIndex
+        tokens = [self.token(i).decode("utf-8") for i in range(len(self.vocab_ptr)-1)]
+        return FuzzyIndex(tokens, max_distance)
+
+    # ------------------------------------------
+    # tokens not in the vocabulary will be replaced by the closest one,
+    # up to max_distance edits away, as long as the time spent in the
+    # current sentence (scan) or position (find_drug) is below budget
+    # seconds (no limit if None)
+    def enable_fuzzy(self, max_distance=1, budget=None) :
+        self.fuzzy = self.fuzzy_index(max_distance) if max_distance > 0 else None
+        self.fuzzy_budget = budget
+
+    # ------------------------------------------
+    # id of a (lowercased) token, with approximate lookup if enabled
+    # and deadline (in perf_counter time) has not passed
+    def word_id(self, t, deadline=None) :
+        i = self.token_id(t)
+        if i < 0 and self.fuzzy is not None and (deadline is None or time.perf_counter() < deadline) :
+            i = self.fuzzy.lookup(t)[0]
+        return i
+
+    # ------------------------------------------
+    # end of the time budget for approximate lookups started now
+    def deadline(self) :
+        if self.fuzzy is None or self.fuzzy_budget is None : return None
+        return time.perf_counter() + self.fuzzy_budget
 
-        # not in tree, or "END" not found for given fragment
-        return None, 0
+    # ------------------------------------------
+    # i-th token in the vocabulary, as utf-8
+    def token(self, i) :
+        return bytes(self.vocab[self.vocab_ptr[i]:self.vocab_ptr[i+1]])
 
     # ------------------------------------------
+    # child of a node reached with given token id, or -1
+    def child(self, node, t) :
+        if node == 0 : return self.root_children()[t]
+        lo, hi = int(self.child_ptr[node]), int(self.child_ptr[node+1])
+        k = lo + int(numpy.searchsorted(self.child_tok[lo:hi], t))
+        if k < hi and self.child_tok[k] == t : return int(self.child_node[k])
+        return -1
+
+    # ------------------------------------------
+    # child of the root reached with each token id (or -1). Most tokens
+    # are looked up at the root, and it has most children, so they are
+    # found in this table instead of searching
+    def root_children(self) :
+        if self.root is None :
+            n = int(self.child_ptr[1])
+            root = numpy.full(len(self.vocab_ptr)-1, -1, dtype=numpy.int64)
+            root[self.child_tok[:n]] = self.child_node[:n]
+            self.root = root.tolist()
+        return self.root
+
+    # ------------------------------------------
+    # longest drug name starting at position i of a list of token
+    # ids. Return its type and last position, or (None, 0)
+    def match(self, ids, i) :
+        kind, end = None, 0
+        node = 0
+        for j in range(i, len(ids)) :
+            if ids[j] < 0 : break
+            node = self.child(node, ids[j])
+            if node < 0 : break
+            if self.node_kind[node] >= 0 :
+                kind, end = self.kinds[self.node_kind[node]], j
+        return kind, end
+
+    # ------------------------------------------
+    # find the longest drug name starting at token i. Return its
+    # type and last token, or (None, 0) if no drug name starts there
     def find_drug(self, tks, i) :
-        return self.search_drug(self.tree, [t.text.lower() for t in tks], i)
+        # only tokens that may be part of the name are normalized
+        ids = []
+        deadline = self.deadline()
+        for t in tks[i:] :
+            ids.append(self.word_id(t.text.lower(), deadline))
+            if ids[-1] < 0 : break
+        kind, end = self.match(ids, 0)
+        return (kind, i+end) if kind is not None else (None, 0)
+
+    # ------------------------------------------
+    # find all drug names in a list of tokens, scanning left to right:
+    # the longest name starting at each position is taken, and the scan
+    # goes on after it. Return a list of (first, last, type) tokens
+    def scan(self, tks) :
+        deadline = self.deadline()
+        ids = [self.word_id(t.text.lower(), deadline) for t in tks]
+        found = []
+        i = 0
+        while i < len(ids) :
+            kind, end = self.match(ids, i) if ids[i] >= 0 else (None, 0)
+            if kind is not None :
+                found.append((i, end, kind))
+                i = end
+            i += 1
+        return found
+
+    # ------------------------------------------
+    # rebuild the trie as nested dicts (legacy JSON format)
+    def tree(self, node=0) :
+        result = {}
+        for k in range(self.child_ptr[node], self.child_ptr[node+1]) :
+            t = self.token(self.child_tok[k]).decode("utf-8")
+            result[t] = self.tree(self.child_node[k])
+        if self.node_kind[node] >= 0 :
+            result["END"] = self.kinds[self.node_kind[node]]
+        return result
 
     # ------------------------------------------
     def dump(self, file=sys.stdout) :
-        json.dump(self.tree, file, indent=3, ensure_ascii=False)
-        
-        
-             
+        json.dump(self.tree(), file, indent=3, ensure_ascii=False)
+
+
+# ------------------------------------------
+# view of the sorted vocabulary of an index, for bisect
+class _Keys :
+    def __init__(self, index) :
+        self.index = index
+    def __len__(self) :
+        return len(self.index.vocab_ptr)-1
+    def __getitem__(self, i) :
+        return self.index.token(i)
+
+
+
+# ------------------------------------------
+# resource files the index is built from
+RESOURCE_FILES = ["HSDB.txt", "DrugBank.txt", "drugs-train.txt"]
+
+# ------------------------------------------
+# read drug names in resource files, line by line. Yield
+# the (lowercased) tokens and the type of each name
+def resource_entries(resources) :
+    print("Collecting drugs from HSDB")
+    with open(os.path.join(resources,"HSDB.txt")) as h :
+        for n,x in enumerate(h, 1) :
+            tks = x.strip().lower().split()
+            if tks : yield tks, "drug"
+            if n%11==0 : print(f"{n} lines processed.        \r", end="")
+
+    print("Collecting drugs from DrugBank")
+    with open(os.path.join(resources,"DrugBank.txt"), encoding="utf-8") as h :
+        for x in h :
+            if not x.strip() : continue
+            (n,t) = x.strip().lower().split("|")
+            yield n.split(), t
+
+    print("Collecting drugs from drugs-train")
+    with open(os.path.join(resources,"drugs-train.txt")) as h :
+        for x in h :
+            if not x.strip() : continue
+            (_,_,n,t) = x.strip().lower().split("|")
+            yield n.split(), t
+
+
+# ------------------------------------------
+# size, modification time and content hash of each resource file.
+# Hashes in 'previous' are reused for files whose size and time
+# did not change, so unchanged files are not read again
+def resource_manifest(resources, previous=None) :
+    previous = previous or {}
+    manifest = {"format" : MAGIC.decode().strip(), "files" : {}}
+    for fname in RESOURCE_FILES :
+        path = os.path.join(resources, fname)
+        st = os.stat(path)
+        entry = {"size" : st.st_size, "mtime" : st.st_mtime_ns}
+        old = previous.get("files", {}).get(fname)
+        if old is not None and all(old.get(k) == v for k,v in entry.items()) :
+            entry["sha1"] = old["sha1"]
+        else :
+            h = hashlib.sha1()
+            with open(path, "rb") as f :
+                for block in iter(lambda : f.read(1 << 20), b"") :
+                    h.update(block)
+            entry["sha1"] = h.hexdigest()
+        manifest["files"][fname] = entry
+    return manifest
+
+
+# ------------------------------------------
+# load index in idxfile if it was built from the current content of
+# the resource files (as recorded in idxfile.manifest). Otherwise,
+# build it again and save it with its manifest. Returns the index
+def cached_index(resources, idxfile) :
+    manifestfile = idxfile + ".manifest"
+    previous = None
+    if os.path.exists(idxfile) and os.path.exists(manifestfile) :
+        with open(manifestfile) as mf :
+            previous = json.load(mf)
+
+    manifest = resource_manifest(resources, previous)
+    same = lambda m : None if m is None else (m["format"], {f:e["sha1"] for f,e in m["files"].items()})
+    if previous is not None and same(previous) == same(manifest) :
+        print("Resource files did not change, using cached index")
+        index = DrugIndex(idxfile)
+    else :
+        index = DrugIndex(resources=resources)
+        index.save(idxfile)
+
+    # record current times, so unchanged files are not hashed next time
+    with open(manifestfile + ".tmp", "w") as mf :
+        json.dump(manifest, mf, indent=1)
+    os.replace(manifestfile + ".tmp", manifestfile)
+    return index
+
+
+## -- Usage:  drug_index.py outfile
+## --
+## -- Builds the index from the resources folder, and saves it to outfile
+## -- (in legacy JSON format if outfile ends with .json, else binary)
+
 if __name__ == "__main__" :
 
     outfile = sys.argv[1]
@@ -88,9 +391,12 @@ if __name__ == "__main__" :
     RESOURCESDIR=os.path.join(MAINDIR, "resources")
 
 
-    # create a new index and dump it to file
+    # create a new index and save it to file
     drugs = DrugIndex(resources=RESOURCESDIR)
-    with open(outfile, "w") as of:
-       drugs.dump(file=of)
-      
-      
+    if outfile.endswith(".json") :
+        with open(outfile, "w", encoding="utf-8") as of:
+            drugs.dump(file=of)
+    else :
+        drugs.save(outfile)
+
+
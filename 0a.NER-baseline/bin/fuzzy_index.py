@@ -0,0 +1,204 @@
+#! /usr/bin/python3
+
+# Approximate lookup of tokens in the drug index vocabulary, to tag
+# misspelled or variant names (e.g. "acetaminophene", "warfarine").
+#
+# SymSpell-style deletion index: each vocabulary token is stored under all
+# the strings obtained deleting up to max_distance characters from its
+# first prefix_length characters. A query word generates its own deletes,
+# and any token sharing one of them is a candidate, checked with the real
+# edit distance (optimal string alignment: insertions, deletions,
+# substitutions and transpositions). Only deletes are generated, so the
+# number of lookups does not depend on the alphabet, and limiting them to
+# a prefix keeps the index small.
+#
+# Delete strings are stored as crc32 hashes in a sorted numpy array, with
+# the token id of each entry alongside, so the index takes a few bytes per
+# entry instead of a python string. Hash collisions only add candidates,
+# which are then discarded by the distance check.
+
+import os, sys
+import re
+import time
+import zlib
+from itertools import combinations
+
+import numpy
+
+# only words with letters and no digits are looked up approximately
+# (numbers, dosages, codes... must match exactly)
+FUZZY_WORD = re.compile(r"[^\W\d_][^\W\d]*")
+
+
+## ------ crc32 hash of a string
+def _hash(s) :
+    return zlib.crc32(s.encode("utf-8"))
+
+
+## ------ strings obtained deleting up to n characters from s
+def deletes(s, n) :
+    result = {s}
+    for k in range(1, min(n, len(s))+1) :
+        for pos in combinations(range(len(s)), k) :
+            result.add("".join(c for i,c in enumerate(s) if i not in pos))
+    return result
+
+
+## --------------------------------------------------
+## optimal string alignment distance between a and b, or
+## n+1 if it is larger than n
+## --------------------------------------------------
+def edit_distance(a, b, n) :
+    if abs(len(a)-len(b)) > n : return n+1
+    prev2 = None
+    prev = list(range(len(b)+1))
+    for i in range(1, len(a)+1) :
+        cur = [i] + [0]*len(b)
+        for j in range(1, len(b)+1) :
+            cost = 0 if a[i-1] == b[j-1] else 1
+            cur[j] = min(prev[j]+1, cur[j-1]+1, prev[j-1]+cost)
+            if i > 1 and j > 1 and a[i-1] == b[j-2] and a[i-2] == b[j-1] :
+                cur[j] = min(cur[j], prev2[j-2]+1)
+        if min(cur) > n : return n+1
+        prev2, prev = prev, cur
+    return prev[-1] if prev[-1] <= n else n+1
+
+
+class FuzzyIndex :
+
+    ## --------------------------------------------------
+    ## Constructor: index given tokens (position in the list is the
+    ## token id) for lookups at distance up to max_distance. Tokens and
+    ## queries shorter than min_length are not considered.
+    ## --------------------------------------------------
+    def __init__(self, tokens, max_distance=1, min_length=5, prefix_length=7) :
+        self.tokens = tokens
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.prefix_length = prefix_length
+        # words already looked up
+        self.found = {}
+
+        keys = []
+        ids = []
+        for t,tk in enumerate(tokens) :
+            if len(tk) < min_length or not FUZZY_WORD.fullmatch(tk) : continue
+            for d in deletes(tk[:prefix_length], max_distance) :
+                keys.append(_hash(d))
+                ids.append(t)
+        keys = numpy.array(keys, dtype=numpy.uint32)
+        ids = numpy.array(ids, dtype=numpy.int32)
+        order = numpy.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = ids[order]
+
+    ## --------------------------------------------------
+    ## closest token to given word, as (token id, distance),
+    ## or (-1, None) if there is none within max_distance
+    ## --------------------------------------------------
+    def lookup(self, word) :
+        if word in self.found : return self.found[word]
+
+        best = (-1, None)
+        if len(word) >= self.min_length and FUZZY_WORD.fullmatch(word) :
+            n = self.max_distance
+            hashes = numpy.array([_hash(d) for d in deletes(word[:self.prefix_length], n)], dtype=numpy.uint32)
+            lo = numpy.searchsorted(self.keys, hashes, side="left")
+            hi = numpy.searchsorted(self.keys, hashes, side="right")
+            candidates = set()
+            for a,b in zip(lo.tolist(), hi.tolist()) :
+                candidates.update(self.ids[a:b].tolist())
+            # closest candidate, and the first one in the vocabulary on ties
+            for t in sorted(candidates) :
+                d = edit_distance(word, self.tokens[t], n)
+                if d <= n and (best[1] is None or d < best[1]) :
+                    best = (t, d)
+                    n = d
+
+        self.found[word] = best
+        return best
+
+    ## --------------------------------------------------
+    ## same as lookup, comparing the word with every token
+    ## in the vocabulary (for benchmarking)
+    ## --------------------------------------------------
+    def lookup_naive(self, word) :
+        best = (-1, None)
+        if len(word) >= self.min_length and FUZZY_WORD.fullmatch(word) :
+            n = self.max_distance
+            for t,tk in enumerate(self.tokens) :
+                if len(tk) < self.min_length or not FUZZY_WORD.fullmatch(tk) : continue
+                d = edit_distance(word, tk, n)
+                if d <= n and (best[1] is None or d < best[1]) :
+                    best = (t, d)
+                    n = d
+        return best
+
+
+## --------------------------------------------------
+## Benchmark lookup latency: words from the index vocabulary with
+## random edits (misspellings), and words not in any drug name
+## --------------------------------------------------
+def benchmark(index, max_distance=1, nwords=2000, naive=20, seed=0) :
+    import random
+
+    rng = random.Random(seed)
+    t = time.perf_counter()
+    fuzzy = index.fuzzy_index(max_distance)
+    print(f"build index: {time.perf_counter()-t:.2f} s, {len(fuzzy.keys)} entries "
+          f"({(fuzzy.keys.nbytes+fuzzy.ids.nbytes)/1e6:.1f} MB)")
+
+    # misspelled drug tokens (one random edit), and plain words
+    vocab = [tk for tk in fuzzy.tokens if len(tk) >= fuzzy.min_length and FUZZY_WORD.fullmatch(tk)]
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    def misspell(w) :
+        i = rng.randrange(len(w))
+        op = rng.choice(["sub", "ins", "del", "swap"])
+        if op == "sub" : return w[:i] + rng.choice(letters) + w[i+1:]
+        if op == "ins" : return w[:i] + rng.choice(letters) + w[i:]
+        if op == "swap" and i+1 < len(w) : return w[:i] + w[i+1] + w[i] + w[i+2:]
+        return w[:i] + w[i+1:]
+    misspelled = [misspell(rng.choice(vocab)) for _ in range(nwords)]
+    plain = ["patient", "received", "administration", "increased", "concentrations",
+             "interaction", "therapy", "clinical", "studies", "effects"]
+    plain = [rng.choice(plain) + rng.choice(["", "s", "ly"]) for _ in range(nwords)]
+
+    for name,words in [("misspelled drug tokens", misspelled), ("plain words", plain)] :
+        times = []
+        hits = 0
+        for w in words :
+            # time uncached lookups
+            fuzzy.found.clear()
+            t = time.perf_counter()
+            tid, _ = fuzzy.lookup(w)
+            times.append(time.perf_counter()-t)
+            hits += tid >= 0
+        times = numpy.array(times)*1e6
+        print(f"{name:<24} {len(words)} lookups, {hits} found. latency (us): "
+              f"mean {times.mean():.0f}, p50 {numpy.percentile(times,50):.0f}, "
+              f"p99 {numpy.percentile(times,99):.0f}, max {times.max():.0f}")
+
+    if naive :
+        t = time.perf_counter()
+        same = sum(fuzzy.lookup_naive(w) == fuzzy.lookup(w) for w in misspelled[:naive])
+        print(f"naive search over the vocabulary: {1e3*(time.perf_counter()-t)/naive:.0f} ms per lookup "
+              f"(same result as the index for {same} of {naive} words)")
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  fuzzy_index.py drug_index [max_distance [nwords]]
+## --
+## -- Benchmarks approximate lookup latency on the given index
+## --
+
+if __name__ == "__main__" :
+    if len(sys.argv) < 2 :
+        print(f"usage:  {os.path.basename(__file__)} drug_index [max_distance [nwords]]")
+        sys.exit(0)
+
+    from drug_index import DrugIndex
+    index = DrugIndex(sys.argv[1])
+    benchmark(index,
+              max_distance=int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+              nwords=int(sys.argv[3]) if len(sys.argv) > 3 else 2000)
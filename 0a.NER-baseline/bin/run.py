@@ -1,8 +1,9 @@
 #! /usr/bin/python3
 
 import sys, os
-from drug_index import DrugIndex
+from drug_index import cached_index
 from baseline_NER import NER_baseline
+from char_matcher import CharMatcher, NER_char_baseline, agreement
 
 BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
 NERDIR=os.path.dirname(BINDIR) # one level up
@@ -14,26 +15,93 @@ UTILDIR=os.path.join(MAINDIR,"util") # down to "util"
 sys.path.append(UTILDIR)
 from gold_extractor import GoldExtractor
 from evaluator import evaluate
+import profiler
+
+# extract options and analyzer parameters from command line,
+# e.g. --tokenizer=regex batch_size=128 n_process=2
+# With --profile[=DIR], time spent in each stage is printed at the end
+# (and, if DIR is given, each step is profiled with cProfile into DIR)
+# --matcher=token (default) tokenizes sentences and looks tokens up in the
+# index, --matcher=char matches names on the sentence characters without
+# a tokenizer (see char_matcher.py), and --matcher=both runs the two,
+# writing <ds>.out and <ds>-char.out, and prints their agreement.
+# With --fuzzy=D, the token matcher also accepts index tokens up to D edits
+# away (e.g. misspellings), spending at most --fuzzy-budget=MS milliseconds
+# per sentence on it
+options = {}
+params = {}
+for p in sys.argv[1:]:
+    if p.startswith("--"):
+        opt,_,val = p[2:].partition("=")
+        options[opt] = val
+    elif "=" in p:
+        par,val = p.split("=")
+        params[par] = val
+tokenizer = options["tokenizer"] if "tokenizer" in options else "trf"
+# analyzed sentences are cached in MAINDIR/cache unless --no-cache is given
+cachedir = options["cachedir"] if "cachedir" in options else os.path.join(MAINDIR,"cache")
+if "no-cache" in options : cachedir = None
+batch_size = int(params['batch_size']) if 'batch_size' in params else 64
+n_process = int(params['n_process']) if 'n_process' in params else 1
+matcher = options["matcher"] if "matcher" in options else "token"
+fuzzy = int(options["fuzzy"]) if "fuzzy" in options else 0
+fuzzy_budget = float(options["fuzzy-budget"])/1000 if "fuzzy-budget" in options else None
+if matcher not in ["token", "char", "both"] :
+    print(f"Invalid matcher '{matcher}'. Please specify one of token, char, both.")
+    sys.exit(1)
+profiler.enable_from_options(options)
 
 # if feature extraction is required, do it
-print("Extracting drugs from train data")
-gold = GoldExtractor(os.path.join(DATADIR,"train.xml"))
-gold.extract_NER(os.path.join(RESOURCESDIR,"drugs-train.txt"))
+# drug names in train data are extracted again only if it changed
+trainfile = os.path.join(DATADIR,"train.xml")
+drugsfile = os.path.join(RESOURCESDIR,"drugs-train.txt")
+if not os.path.exists(drugsfile) or \
+   (os.path.exists(trainfile) and os.path.getmtime(trainfile) > os.path.getmtime(drugsfile)) :
+    print("Extracting drugs from train data")
+    with profiler.stage("gold extraction") :
+        gold = GoldExtractor(trainfile)
+        gold.extract_NER(drugsfile)
+# the index is only rebuilt if some resource file changed
 print("Creating index with all known drug names")
-idx = DrugIndex(resources=RESOURCESDIR)    
-idxfile = os.path.join(RESOURCESDIR,"drug-index.json")
-with open(idxfile,"w", encoding="utf-8") as jf: idx.dump(file=jf)
+with profiler.stage("index build") :
+    idxfile = os.path.join(RESOURCESDIR,"drug-index.bin")
+    idx = cached_index(RESOURCESDIR, idxfile)
+# character matcher, built once for all datasets
+if matcher != "token" :
+    with profiler.stage("build char matcher") :
+        chars = CharMatcher(idx)
 
 print("Applying index to predict drugs")
 os.makedirs(os.path.join(NERDIR,"results"), exist_ok=True)
 for ds in ["devel", "test"]:
+   # output file of each matcher to run
+   outfiles = {}
+   if matcher != "char" : outfiles["token"] = os.path.join(NERDIR,"results",f"{ds}.out")
+   if matcher == "char" : outfiles["char"] = os.path.join(NERDIR,"results",f"{ds}.out")
+   if matcher == "both" : outfiles["char"] = os.path.join(NERDIR,"results",f"{ds}-char.out")
+
    print(f"Running baseline on {ds}                   ")
-   NER_baseline(os.path.join(DATADIR,f"{ds}.xml"), 
-                idxfile, 
-                os.path.join(NERDIR,"results",f"{ds}.out"))
+   if "token" in outfiles :
+      with profiler.stage(f"baseline {ds}") :
+         NER_baseline(os.path.join(DATADIR,f"{ds}.xml"), 
+                      idxfile, 
+                      outfiles["token"],
+                      batch_size, n_process, tokenizer, cachedir,
+                      fuzzy, fuzzy_budget)
+   if "char" in outfiles :
+      with profiler.stage(f"char baseline {ds}") :
+         NER_char_baseline(os.path.join(DATADIR,f"{ds}.xml"), idxfile, outfiles["char"], chars)
+
    print(f"Evaluating baseline on {ds}                ")
-   evaluate("NER",
-            os.path.join(DATADIR,f"{ds}.xml"),
-            os.path.join(NERDIR,"results",f"{ds}.out"),
-            os.path.join(NERDIR,"results",f"{ds}.stats"))
+   for m,outfile in outfiles.items() :
+      with profiler.stage(f"evaluate {ds}") :
+         evaluate("NER",
+                  os.path.join(DATADIR,f"{ds}.xml"),
+                  outfile,
+                  outfile[:-len(".out")]+".stats")
+   if matcher == "both" :
+      print(f"Agreement of token and char matchers on {ds}")
+      agreement(outfiles["token"], outfiles["char"])
 
+# print time spent in each stage, if --profile was given
+profiler.report()
@@ -2,10 +2,15 @@
 ## Class to store an ngram ME model
 #####################################################
 
-import sys
+import sys, os
 import pycrfsuite
 from dataset import *
 
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+import profiler
+
 
 class CRF:
 
@@ -30,6 +35,8 @@ class CRF:
             c1 = float(params['c1']) if 'c1' in params else 0.1
             c2 = float(params['c2']) if 'c2' in params else 0.3
             eps = float(params['epsilon']) if 'epsilon' in params else 0.00001
+            # feature selection (min_count, top_k, select, single_label), see dataset.py
+            self.selection = selection_params(params)
             # select needed parametes depending on the agorithm
             params = {'feature.minfreq' : minf, 'max_iterations' : maxit}
             if alg == "lbfgs" : params['c1'] = c1
@@ -43,13 +50,28 @@ class CRF:
     ## --------------------------------------------------
     def train(self, datafile):
         # load dataset
-        ds = Dataset(datafile)
+        with profiler.stage("load features") :
+            ds = Dataset(datafile)
+
+        # remove useless features, if required. Selected features are
+        # computed on words, CRF uses them on sequences as they are
+        fidx = None
+        if selection_requested(**self.selection) :
+            with profiler.stage("feature selection") :
+                X,Y = ds.csr_matrix()
+                ds.select_features(X, Y, **self.selection)
+                fidx = ds.feature_index()
+
         # add examples to trainer
-        for xseq, yseq, _ in ds.instances() :
-            self.trainer.append(xseq, yseq, 0)
+        with profiler.stage("vectorization") :
+            for xseq, yseq, _ in ds.instances() :
+                if fidx is not None :
+                    xseq = [[f for f in w if f in fidx] for w in xseq]
+                self.trainer.append(xseq, yseq, 0)
 
         # train and store model 
-        self.trainer.train(self.modelfile, -1)
+        with profiler.stage("fit") :
+            self.trainer.train(self.modelfile, -1)
 
         
     ## --------------------------------------------------
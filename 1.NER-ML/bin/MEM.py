@@ -1,14 +1,19 @@
 #####################################################
 ## Class to store an ngram ME model
 #####################################################
-import sys
+import sys, os
 import pickle
 
+import numpy
 import scipy
-import sklearn
-from sklearn.linear_model import LogisticRegression
 
 import dataset
+from linear import LinearModel, export_linear
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+import profiler
 
 
 class MEM:
@@ -20,11 +25,16 @@ class MEM:
 
         self.modelfile = modelfile
         if params is None:
-            # only modelfile given, assume it is an existing model and load it        
-            with open(self.modelfile, 'rb') as df :
-                self.tagger = pickle.load(df)
-            with open(self.modelfile+".idx", 'rb') as df :
-                self.fidx = pickle.load(df)
+            # only modelfile given, assume it is an existing model and load it.
+            # Use the compact version if there is one (see linear.py)
+            if LinearModel.exists(self.modelfile) :
+                self.tagger = LinearModel(self.modelfile)
+                self.fidx = self.tagger.fidx
+            else :
+                with open(self.modelfile, 'rb') as df :
+                    self.tagger = pickle.load(df)
+                with open(self.modelfile+".idx", 'rb') as df :
+                    self.fidx = pickle.load(df)
                 
         else :  # params given, create new empty model
 
@@ -33,8 +43,36 @@ class MEM:
             solver = params['solver'] if 'solver' in params else 'lbfgs'
             maxit = params['max_iter'] if 'max_iter' in params else 1500
             jobs = params['n_jobs'] if 'n_jobs' in params else 8
+            # if given, features are hashed to 2^hash_bits columns
+            # instead of using an index of all training features
+            self.hash_bits = int(params['hash_bits']) if 'hash_bits' in params else None
+            # fraction of O words used for training (all if 1). With o_stratify=lexicon,
+            # O words matching some lexicon are all kept. Samples are reweighted.
+            self.o_rate = float(params['o_rate']) if 'o_rate' in params else 1.0
+            if not 0 < self.o_rate <= 1 :
+                print(f"Invalid o_rate '{params['o_rate']}', must be in (0, 1]", file=sys.stderr)
+                sys.exit(1)
+            self.o_stratify = params['o_stratify'] if 'o_stratify' in params else None
+            # feature selection (min_count, top_k, select, single_label), see dataset.py
+            self.selection = dataset.selection_params(params)
+            # streaming training: the data is read in chunks of about chunk_size
+            # words, and the model is updated with each of them (SGD), for the
+            # given number of epochs. With warm_start, training goes on from the
+            # existing streamed model in modelfile, if any
+            self.stream = int(params['stream']) if 'stream' in params else 0
+            self.epochs = int(params['epochs']) if 'epochs' in params else 5
+            self.chunk_size = int(params['chunk_size']) if 'chunk_size' in params else 50000
+            self.warm_start = int(params['warm_start']) if 'warm_start' in params else 0
+
+            if self.stream :
+                alpha = float(params['alpha']) if 'alpha' in params else 1e-4
+                from sklearn.linear_model import SGDClassifier
+                self.tagger = SGDClassifier(loss="log_loss", alpha=alpha, random_state=0)
+                return
 
             # create and train empty classifier with given parameters
+            # (sklearn is only needed to train, or to load pickled models)
+            from sklearn.linear_model import LogisticRegression
             self.tagger = LogisticRegression(verbose=1,
                                              C=C,
                                              solver=solver,
@@ -46,20 +84,103 @@ class MEM:
     ## train a model on given data, store in modelfile
     ## --------------------------------------------------
     def train(self, datafile):
+        if self.stream :
+            self.train_stream(datafile)
+            return
+
         # load dataset
-        ds = dataset.Dataset(datafile)
-        self.fidx = ds.feature_index()
+        with profiler.stage("load features") :
+            fidx = dataset.HashIndex(self.hash_bits) if self.hash_bits else None
+            ds = dataset.Dataset(datafile, fidx=fidx)
+            self.fidx = ds.feature_index()
 
         # Read training instances 
-        X,Y = ds.csr_matrix()
+        with profiler.stage("vectorization") :
+            X,Y = ds.csr_matrix()
+
+        # remove useless features, if required
+        with profiler.stage("feature selection") :
+            X = ds.select_features(X, Y, **self.selection)
+            self.fidx = ds.feature_index()
+
+        # keep only part of the O words, if required
+        with profiler.stage("sampling") :
+            X,Y,weights = dataset.sample_training(ds, X, Y, self.o_rate, self.o_stratify)
 
         # train classifier
-        self.tagger.fit(X,Y)
+        with profiler.stage("fit") :
+            self.tagger.fit(X,Y,sample_weight=weights)
 
         # save model
+        with profiler.stage("save model") :
+            self.save()
+
+    ## --------------------------------------------------
+    ## train a model on given data, reading it in chunks and
+    ## updating the model with each of them (see Dataset.chunks)
+    ## --------------------------------------------------
+    def train_stream(self, datafile):
+        # continue training an existing model, if required. Its feature
+        # index is kept, so features not seen before are ignored (unless
+        # the model uses hashing)
+        classes = None
+        if self.warm_start and os.path.exists(self.modelfile) :
+            with open(self.modelfile, 'rb') as df :
+                tagger = pickle.load(df)
+            if not hasattr(tagger, "partial_fit") :
+                print(f"{self.modelfile} was not trained in stream mode, can not continue training it", file=sys.stderr)
+                sys.exit(1)
+            self.tagger = tagger
+            classes = tagger.classes_
+            with open(self.modelfile+".idx", 'rb') as df :
+                fidx = pickle.load(df)
+            print(f"continuing training of {self.modelfile}", file=sys.stderr)
+        else :
+            fidx = dataset.HashIndex(self.hash_bits) if self.hash_bits else None
+
+        # text datafiles are not loaded in memory. Without hashing nor an
+        # existing index, features are indexed in a first pass over the file
+        with profiler.stage("load features") :
+            ds = dataset.Dataset(datafile, fidx=fidx, stream=True)
+            self.fidx = ds.feature_index()
+            if classes is None :
+                classes = ds.label_set()
+            else :
+                # partial_fit can not add classes to an existing model
+                missing = sorted(set(ds.label_set()) - set(classes))
+                if missing :
+                    print(f"labels {', '.join(missing)} are not in {self.modelfile}, can not continue training it. "
+                          f"Train it from scratch (warm_start=0)", file=sys.stderr)
+                    sys.exit(1)
+
+        if self.o_stratify is not None :
+            print("o_stratify is not supported in stream mode, ignored", file=sys.stderr)
+        if dataset.selection_requested(**self.selection) :
+            print("feature selection is not supported in stream mode, ignored", file=sys.stderr)
+
+        for epoch in range(self.epochs) :
+            nwords = 0
+            for k,(X,Y) in enumerate(profiler.timed_iter("vectorization", ds.chunks(self.chunk_size))) :
+                weights = None
+                if self.o_rate < 1.0 :
+                    # different O words are kept in each chunk and epoch
+                    rows, weights = dataset.sample_negatives(Y, self.o_rate, seed=epoch*1000003+k)
+                    X, Y = X[rows], numpy.asarray(Y)[rows]
+                with profiler.stage("fit") :
+                    self.tagger.partial_fit(X, Y, classes=classes, sample_weight=weights)
+                nwords += X.shape[0]
+            print(f"epoch {epoch+1}/{self.epochs}: {nwords} words", file=sys.stderr)
+
+        with profiler.stage("save model") :
+            self.save()
+
+    ## ------ store trained model and feature index in modelfile
+    def save(self):
         pickle.dump(self.tagger, open(self.modelfile, 'wb'))
         pickle.dump(self.fidx, open(self.modelfile+".idx", 'wb'))
-    
+        # compact version, loaded by predict without sklearn
+        export_linear(self.tagger, self.fidx, self.modelfile)
+
 
     ## --------------------------------------------------
     ## predict best class for given example
@@ -84,5 +205,16 @@ class MEM:
         X = scipy.sparse.csr_matrix((data, (rowi, colj)), shape=(len(xseq),len(self.fidx)))
         
         # apply model to X and return predictions
-        return self.tagger.predict(X)
+        return self.predict_matrix(X)
+
+    ## --------------------------------------------------
+    ## predict best class for each row (word) in a CSR matrix
+    ## encoded with the model feature index (see Dataset).
+    ## Rows are predicted in chunks, to bound memory use
+    ## --------------------------------------------------
+    def predict_matrix(self, X, chunk_size=20000):
+        if X.shape[0]==0 : return []
+        if X.shape[0] <= chunk_size : return self.tagger.predict(X)
+        return numpy.concatenate([self.tagger.predict(X[i:i+chunk_size])
+                                  for i in range(0, X.shape[0], chunk_size)])
 
@@ -1,14 +1,19 @@
 #####################################################
 ## Class to store an ngram ME model
 #####################################################
-import sys
+import sys, os
 import pickle
 
+import numpy
 import scipy
-import sklearn
-from sklearn.svm import SVC
 
 import dataset
+from linear import LinearModel, export_linear, remove_linear
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+import profiler
 
 class SVM:
 
@@ -20,27 +25,97 @@ class SVM:
         self.modelfile = modelfile
         
         if params is None :
-            # only modelfile given, assume it is an existing model and load it        
-            with open(self.modelfile, 'rb') as df :
-                self.tagger = pickle.load(df)
-            with open(self.modelfile+".idx", 'rb') as df :
-                self.fidx = pickle.load(df)
+            # only modelfile given, assume it is an existing model and load it.
+            # Use the compact version if there is one (see linear.py)
+            if LinearModel.exists(self.modelfile) :
+                self.tagger = LinearModel(self.modelfile)
+                self.fidx = self.tagger.fidx
+            else :
+                with open(self.modelfile, 'rb') as df :
+                    self.tagger = pickle.load(df)
+                with open(self.modelfile+".idx", 'rb') as df :
+                    self.fidx = pickle.load(df)
 
         else : # params given, create new empty model
 
             # extract parameters if provided. Use default if not
             C = float(params['C']) if 'C' in params else 1.0
-            kernel = params['kernel'] if 'kernel' in params else 'rbf'
+            # default kernel is rbf, or linear for the linear engines (see below)
+            kernel = params['kernel'] if 'kernel' in params else None
             degree = int(params['degree']) if 'degree' in params else 3
             gamma = float(params['gamma']) if 'gamma' in params else 'scale'
+            # if given, features are hashed to 2^hash_bits columns
+            # instead of using an index of all training features
+            self.hash_bits = int(params['hash_bits']) if 'hash_bits' in params else None
+            # fraction of O words used for training (all if 1). With o_stratify=lexicon,
+            # O words matching some lexicon are all kept. Samples are reweighted.
+            self.o_rate = float(params['o_rate']) if 'o_rate' in params else 1.0
+            if not 0 < self.o_rate <= 1 :
+                print(f"Invalid o_rate '{params['o_rate']}', must be in (0, 1]", file=sys.stderr)
+                sys.exit(1)
+            self.o_stratify = params['o_stratify'] if 'o_stratify' in params else None
+            # feature selection (min_count, top_k, select, single_label), see dataset.py
+            self.selection = dataset.selection_params(params)
                 
+            # engine used to train the SVM:
+            #   svc: exact SVM with any kernel (sklearn SVC). Slow on large data.
+            #   liblinear: linear kernel, one-vs-rest (LinearSVC)
+            #   sgd: linear kernel, trained with stochastic gradient descent
+            #   nystroem: approximate rbf/poly/sigmoid kernel with n_components
+            #             Nystroem features, followed by LinearSVC
+            #   rbf_sampler: approximate rbf kernel with n_components random
+            #             Fourier features, followed by LinearSVC
+            self.engine = params['engine'] if 'engine' in params else 'svc'
+            engine = self.engine
+            if kernel is None : kernel = 'linear' if engine in ['liblinear', 'sgd'] else 'rbf'
+            n_components = int(params['n_components']) if 'n_components' in params else 300
+            max_iter = int(params['max_iter']) if 'max_iter' in params else 1000
+            self.gamma = gamma
+
             # create classifier
-            self.tagger = SVC(verbose=True,
-                              C=C,
-                              kernel=kernel,
-                              degree=degree,
-                              gamma=gamma
-                              )
+            # (sklearn is only needed to train, or to load pickled models)
+            if engine == 'svc' :
+                from sklearn.svm import SVC
+                self.tagger = SVC(verbose=True,
+                                  C=C,
+                                  kernel=kernel,
+                                  degree=degree,
+                                  gamma=gamma
+                                  )
+            elif engine in ['liblinear', 'sgd'] and kernel != 'linear' :
+                print(f"Kernel '{kernel}' is not supported by engine '{engine}', use engine=svc or engine=nystroem", file=sys.stderr)
+                sys.exit(1)
+            elif engine == 'liblinear' :
+                from sklearn.svm import LinearSVC
+                self.tagger = LinearSVC(C=C, max_iter=max_iter)
+            elif engine == 'sgd' :
+                from sklearn.linear_model import SGDClassifier
+                # alpha is the regularization of the SVM objective scaled by the number
+                # of examples, so it is computed from C once data size is known
+                self.tagger = SGDClassifier(loss='hinge', max_iter=max_iter, tol=1e-4)
+                self.C = C
+            elif engine in ['nystroem', 'rbf_sampler'] :
+                from sklearn.pipeline import make_pipeline
+                from sklearn.svm import LinearSVC
+                from sklearn.kernel_approximation import Nystroem, RBFSampler
+                # gamma='scale' is computed from the data when training
+                if engine == 'nystroem' :
+                    # a linear map followed by a linear SVM is just a slower liblinear
+                    if kernel == 'linear' :
+                        print("Kernel 'linear' is not supported by engine 'nystroem', use engine=liblinear", file=sys.stderr)
+                        sys.exit(1)
+                    approx = Nystroem(kernel=kernel, degree=degree,
+                                      n_components=n_components, random_state=0)
+                else :
+                    # random Fourier features only approximate the rbf kernel
+                    if kernel != 'rbf' :
+                        print(f"Kernel '{kernel}' is not supported by engine 'rbf_sampler', use engine=nystroem", file=sys.stderr)
+                        sys.exit(1)
+                    approx = RBFSampler(n_components=n_components, random_state=0)
+                self.tagger = make_pipeline(approx, LinearSVC(C=C, max_iter=max_iter))
+            else :
+                print(f"Invalid SVM engine '{engine}'", file=sys.stderr)
+                sys.exit(1)
 
 
     ## --------------------------------------------------
@@ -48,18 +123,52 @@ class SVM:
     ## --------------------------------------------------
     def train(self, datafile):
         # load dataset
-        ds = dataset.Dataset(datafile)
-        self.fidx = ds.feature_index()
+        with profiler.stage("load features") :
+            fidx = dataset.HashIndex(self.hash_bits) if self.hash_bits else None
+            ds = dataset.Dataset(datafile, fidx=fidx)
+            self.fidx = ds.feature_index()
 
         # Read training instances 
-        X,Y = ds.csr_matrix()
+        with profiler.stage("vectorization") :
+            X,Y = ds.csr_matrix()
+
+        # remove useless features, if required
+        with profiler.stage("feature selection") :
+            X = ds.select_features(X, Y, **self.selection)
+            self.fidx = ds.feature_index()
+
+        # keep only part of the O words, if required
+        with profiler.stage("sampling") :
+            X,Y,weights = dataset.sample_training(ds, X, Y, self.o_rate, self.o_stratify)
 
         # train classifier
-        self.tagger.fit(X,Y)
+        with profiler.stage("fit") :
+            if self.engine == 'sgd' :
+                self.tagger.set_params(alpha=1.0/(self.C*X.shape[0]))
+            elif self.engine in ['nystroem', 'rbf_sampler'] :
+                gamma = self.gamma
+                if gamma == 'scale' :
+                    # same value SVC uses: 1 / (n_features * X.var())
+                    mean = X.sum() / (X.shape[0]*X.shape[1])
+                    var = X.multiply(X).sum() / (X.shape[0]*X.shape[1]) - mean**2
+                    gamma = 1.0 / (X.shape[1]*var) if var > 0 else 1.0
+                self.tagger.steps[0][1].set_params(gamma=gamma)
+
+            if self.engine in ['nystroem', 'rbf_sampler'] :
+                # weights go to the linear SVM after the kernel approximation
+                self.tagger.fit(X,Y,linearsvc__sample_weight=weights)
+            else :
+                self.tagger.fit(X,Y,sample_weight=weights)
 
         # save model
-        pickle.dump(self.tagger, open(self.modelfile, 'wb'))
-        pickle.dump(self.fidx, open(self.modelfile+".idx", 'wb'))
+        with profiler.stage("save model") :
+            pickle.dump(self.tagger, open(self.modelfile, 'wb'))
+            pickle.dump(self.fidx, open(self.modelfile+".idx", 'wb'))
+            # linear engines have a compact version, loaded by predict without
+            # sklearn. SVC decisions and kernel approximations are not a single
+            # linear score per class of the features, so they have none
+            if self.engine in ['liblinear', 'sgd'] : export_linear(self.tagger, self.fidx, self.modelfile)
+            else : remove_linear(self.modelfile)
     
 
     ## --------------------------------------------------
@@ -84,4 +193,15 @@ class SVM:
         X = scipy.sparse.csr_matrix((data, (rowi, colj)), shape=(len(xseq),len(self.fidx)))
         
         # apply model to X and return predictions
-        return self.tagger.predict(X)
+        return self.predict_matrix(X)
+
+    ## --------------------------------------------------
+    ## predict best class for each row (word) in a CSR matrix
+    ## encoded with the model feature index (see Dataset).
+    ## Rows are predicted in chunks, to bound memory use
+    ## --------------------------------------------------
+    def predict_matrix(self, X, chunk_size=20000):
+        if X.shape[0]==0 : return []
+        if X.shape[0] <= chunk_size : return self.tagger.predict(X)
+        return numpy.concatenate([self.tagger.predict(X[i:i+chunk_size])
+                                  for i in range(0, X.shape[0], chunk_size)])
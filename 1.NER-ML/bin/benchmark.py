@@ -0,0 +1,183 @@
+#! /usr/bin/python3
+
+import sys, os
+import time
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+from analyzer import create_analyzer, ANALYZERS
+from corpus import read_sentences
+
+## --------- spacy batching benchmark -----------
+## -- Analyze all sentences in datafile one by one, and then with
+## -- nlp.pipe at each given batch size. Print sentences/second
+## -- for each setting, and check that token offsets are unchanged.
+
+def bench_pipe(datafile, model="en_core_web_trf", batch_sizes=(1,8,32,64,128,256), n_process=1) :
+    import spacy
+    nlp = spacy.load(model, disable=["parser"])
+    texts = [s.text for s in read_sentences(datafile)]
+
+    # reference: one call per sentence, as extract_features used to do
+    start = time.perf_counter()
+    reference = [[(tk.idx,tk.text) for tk in nlp(t)] for t in texts]
+    elapsed = time.perf_counter() - start
+    print(f"{'nlp(text)':>12}  {len(texts)/elapsed:10.1f} sentences/s")
+
+    for bs in batch_sizes :
+        start = time.perf_counter()
+        docs = [[(tk.idx,tk.text) for tk in d]
+                for d in nlp.pipe(texts, batch_size=bs, n_process=n_process)]
+        elapsed = time.perf_counter() - start
+        same = "" if docs == reference else "  (OFFSETS DIFFER)"
+        print(f"{'batch='+str(bs):>12}  {len(texts)/elapsed:10.1f} sentences/s{same}")
+
+
+## --------- tokenizer backends benchmark -----------
+## -- For each analyzer, print the time needed to load it and the
+## -- average time to analyze one sentence in datafile.
+
+def bench_tokenizers(datafile, names=ANALYZERS, batch_size=64) :
+    texts = [s.text for s in read_sentences(datafile)]
+
+    for name in names :
+        start = time.perf_counter()
+        nlp = create_analyzer(name)
+        startup = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in nlp.pipe(texts, batch_size=batch_size) : pass
+        latency = (time.perf_counter() - start) / len(texts)
+        print(f"{name:>6}  startup {startup:8.3f} s   {latency*1000:8.3f} ms/sentence")
+
+
+## --------- batch prediction benchmark -----------
+## -- Predict all words in datafile with a MEM or SVM model, one
+## -- sentence at a time and with a single batch call. Print time
+## -- of each, and check that predicted labels are the same.
+
+def bench_predict(datafile, modelfile, chunk_size=20000) :
+    from dataset import Dataset
+    from MEM import MEM
+    from SVM import SVM
+    model = MEM(modelfile) if modelfile.lower().endswith(".mem") else SVM(modelfile)
+
+    # reference: one call per sentence
+    start = time.perf_counter()
+    ds = Dataset(datafile)
+    reference = [list(model.predict(xseq)) for xseq,_,_ in ds.instances()]
+    elapsed = time.perf_counter() - start
+    nwords = sum(len(p) for p in reference)
+    print(f"{'per sentence':>14}  {elapsed:8.3f} s  {nwords/elapsed:10.1f} words/s")
+
+    start = time.perf_counter()
+    ds = Dataset(datafile, fidx=model.fidx)
+    X,_ = ds.csr_matrix()
+    offsets = ds.sentence_offsets()
+    labels = model.predict_matrix(X, chunk_size)
+    batch = [list(labels[offsets[k]:offsets[k+1]]) for k in range(len(offsets)-1)]
+    elapsed = time.perf_counter() - start
+    same = "" if batch == reference else "  (LABELS DIFFER)"
+    print(f"{'batch':>14}  {elapsed:8.3f} s  {nwords/elapsed:10.1f} words/s{same}")
+
+
+## --------- training settings benchmark -----------
+## -- Train a model on trainfeat with each of the given settings
+## -- (name, params). For each one, print training and prediction time
+## -- on develfeat, size of the stored model (with its index and
+## -- exported .lin directory), and F1 against gold entities in
+## -- goldfile. Only gold entities of sentences in develfeat are
+## -- used, so goldfile may cover more sentences (e.g. the whole
+## -- devel.xml when develfeat holds a held-out part of it).
+
+def bench_settings(trainfeat, develfeat, goldfile, settings, modeltype="MEM") :
+    import tempfile
+    from dataset import Dataset
+    from train import train
+    from predict import predict
+    from linear import linear_dir
+    from evaluator import load_gold_NER, load_predicted, statistics
+
+    sids = {toks[0][0] for toks in Dataset(develfeat).tokens() if toks}
+    gold = load_gold_NER(goldfile)
+    gold = {kind : {e for e in ents if e.split("|")[0] in sids} for kind,ents in gold.items()}
+    with tempfile.TemporaryDirectory() as tmpdir :
+        modelfile = os.path.join(tmpdir, "model."+modeltype.lower())
+        outfile = os.path.join(tmpdir, "devel.out")
+        for name,params in settings :
+            start = time.perf_counter()
+            train(trainfeat, params, modelfile)
+            ttrain = time.perf_counter() - start
+
+            start = time.perf_counter()
+            predict(develfeat, modelfile, outfile)
+            tpred = time.perf_counter() - start
+
+            size = os.path.getsize(modelfile) + os.path.getsize(modelfile+".idx")
+            lindir = linear_dir(modelfile)
+            if os.path.isdir(lindir) :
+                size += sum(os.path.getsize(os.path.join(lindir,f)) for f in os.listdir(lindir))
+            F1 = statistics(gold, load_predicted("NER", outfile), "CLASS")[-1]
+            print(f"{name:>20}  train {ttrain:8.2f} s  predict {tpred:6.2f} s  size {size/2**20:8.2f} MB  F1 {F1:6.1%}")
+
+
+## -- Compare the feature index with feature hashing at each
+## -- given number of bits
+
+def bench_hashing(trainfeat, develfeat, goldfile, bits=(14,16,18,20), modeltype="MEM") :
+    settings = [("feature index", {})] + [(f"hash {b} bits", {"hash_bits":b}) for b in bits]
+    bench_settings(trainfeat, develfeat, goldfile, settings, modeltype)
+
+
+## -- Compare training on all O words with training on a sample of
+## -- them at each given rate, with and without lexicon stratification
+
+def bench_sampling(trainfeat, develfeat, goldfile, rates=(0.5,0.25,0.1), modeltype="MEM") :
+    settings = [("all O words", {})]
+    for r in rates :
+        settings.append((f"o_rate {r}", {"o_rate":r}))
+        settings.append((f"o_rate {r} lexicon", {"o_rate":r, "o_stratify":"lexicon"}))
+    bench_settings(trainfeat, develfeat, goldfile, settings, modeltype)
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  benchmark.py pipe datafile [model [n_process [batch_size ...]]]
+## --         benchmark.py tokenizer datafile [tokenizer ...]
+## --         benchmark.py predict featfile modelfile [chunk_size]
+## --         benchmark.py hashing trainfeat develfeat devel.xml [MEM|SVM [bits ...]]
+## --         benchmark.py sampling trainfeat develfeat devel.xml [MEM|SVM [rate ...]]
+## --
+
+if __name__ == "__main__" :
+    if len(sys.argv) < 3 :
+        print("usage:  benchmark.py pipe datafile [model [n_process [batch_size ...]]]")
+        print("        benchmark.py tokenizer datafile [tokenizer ...]")
+        print("        benchmark.py predict featfile modelfile [chunk_size]")
+        print("        benchmark.py hashing trainfeat develfeat devel.xml [MEM|SVM [bits ...]]")
+        print("        benchmark.py sampling trainfeat develfeat devel.xml [MEM|SVM [rate ...]]")
+        sys.exit(0)
+
+    if sys.argv[1] == "pipe" :
+        datafile = sys.argv[2]
+        model = sys.argv[3] if len(sys.argv)>3 else "en_core_web_trf"
+        n_process = int(sys.argv[4]) if len(sys.argv)>4 else 1
+        batch_sizes = [int(b) for b in sys.argv[5:]] or (1,8,32,64,128,256)
+        bench_pipe(datafile, model, batch_sizes, n_process)
+    elif sys.argv[1] == "tokenizer" :
+        bench_tokenizers(sys.argv[2], sys.argv[3:] or ANALYZERS)
+    elif sys.argv[1] == "predict" :
+        chunk_size = int(sys.argv[4]) if len(sys.argv)>4 else 20000
+        bench_predict(sys.argv[2], sys.argv[3], chunk_size)
+    elif sys.argv[1] == "hashing" :
+        modeltype = sys.argv[5] if len(sys.argv)>5 else "MEM"
+        bits = [int(b) for b in sys.argv[6:]] or (14,16,18,20)
+        bench_hashing(sys.argv[2], sys.argv[3], sys.argv[4], bits, modeltype)
+    elif sys.argv[1] == "sampling" :
+        modeltype = sys.argv[5] if len(sys.argv)>5 else "MEM"
+        rates = [float(r) for r in sys.argv[6:]] or (0.5,0.25,0.1)
+        bench_sampling(sys.argv[2], sys.argv[3], sys.argv[4], rates, modeltype)
+    else :
+        print(f"Unknown benchmark '{sys.argv[1]}'")
+        sys.exit(1)
@@ -1,3 +1,11 @@
+import sys, os
+import shutil
+import tempfile
+import zlib
+from array import array
+from itertools import islice
+
+import numpy
 import scipy
 #from scipy.sparse import csr_matrix
 
@@ -6,76 +14,561 @@ import scipy
 # Class to handle a dataset made of sentences, where
 # each sentence is a sequence of words, and each word
 # is encoded as a list of (string) features
+#
+# If a binary version of the datafile (see write_binary)
+# exists and is up to date, it is used instead of the text
+# file: feature ids, offsets and labels are memory-mapped
+# from disk instead of being parsed and kept as strings.
+#
+# A feature index (e.g. the one of a trained model) may be
+# given, and it will be used to encode the dataset. Features
+# not in the index are ignored, and counted.
 #-------------------------------------------
 class Dataset :
 
-    ## ------ Constructor. Load given datafile & index features.
-    def __init__(self, datafile) :
-        self.fidx = {}
-        self.sentences = []
-        with open(datafile) as df :
-            for xseq, yseq, toks in self.__sequences(df):
-                # load pair
-                self.sentences.append((xseq,yseq,toks))
-                # add features to index
-                for w in xseq :
-                    for f in w :
-                        if f not in self.fidx :
-                            self.fidx[f] = len(self.fidx)
-
-    ## ------ auxilary for load. 
+    ## ------ Constructor. Load given datafile. Features are indexed
+    ## ------ when needed, unless an existing index is given. If stream
+    ## ------ is True, a text datafile is not loaded in memory, but read
+    ## ------ again each time it is needed (see chunks)
+    def __init__(self, datafile, fidx=None, stream=False) :
+        self.fidx = fidx
+        self.external_index = fidx is not None
+        # features not found in given index (distinct, and occurrences)
+        self.unknown_types = 0
+        self.unknown_tokens = 0
+
+        if binary_is_fresh(datafile) :
+            self.__load_binary(binary_dir(datafile))
+            return
+
+        self.binary = False
+        self.datafile = datafile
+        self.sentences = None
+        if not stream :
+            with open(datafile) as df :
+                self.sentences = list(self.__sequences(df))
+
+    ## ------ auxilary for load.
     def __sequences(self, fi):
-        xseq = []
-        yseq = []
-        toks = []
-
-        for line in fi:
-            line = line.strip('\n')
-            if not line:
-                # An empty line means the end of a sentence.
-                # Return accumulated sequences, and reinitialize.
-                yield xseq, yseq, toks
-                xseq = []
-                yseq = []
-                toks = []
-                continue
-            
-            # Split the line with TAB characters.
-            fields = line.split('\t')
-
-            # Append the item features to the item sequence.
-            # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
-            toks.append(fields[:4]) # token info (sid, form, span)
-            yseq.append(fields[4])  # label (ground truth)
-            xseq.append(fields[5:]) # features
-
-    ## ------ give access to feature index
+        return read_sequences(fi)
+
+    ## ------ sentences of a text dataset, from memory or from file
+    def __text_sentences(self) :
+        if self.sentences is not None :
+            yield from self.sentences
+            return
+        with open(self.datafile) as df :
+            yield from self.__sequences(df)
+
+    ## ------ auxilary for load. Map binary arrays, without reading them
+    def __load_binary(self, bindir) :
+        self.binary = True
+        self.bindir = bindir
+        self.features = numpy.load(os.path.join(bindir,"features.npy"), mmap_mode="r")
+        self.token_ptr = numpy.load(os.path.join(bindir,"token_ptr.npy"), mmap_mode="r")
+        self.sent_ptr = numpy.load(os.path.join(bindir,"sent_ptr.npy"), mmap_mode="r")
+        self.labels = numpy.load(os.path.join(bindir,"labels.npy"), mmap_mode="r")
+        with open(os.path.join(bindir,"labels.txt"), encoding="utf-8") as lf :
+            self.label_names = lf.read().split("\n")[:-1]
+        # feature strings and token info are only loaded if needed
+        self.vocab = None
+        self.toks = None
+        self.remap = None
+
+    ## ------ feature strings, in id order (binary datasets only)
+    def __vocabulary(self) :
+        if self.vocab is None :
+            with open(os.path.join(self.bindir,"vocab.txt"), encoding="utf-8") as vf :
+                self.vocab = vf.read().split("\n")[:-1]
+        return self.vocab
+
+    ## ------ token info (binary datasets only)
+    def __token_info(self) :
+        if self.toks is None :
+            with open(os.path.join(self.bindir,"tokens.tsv"), encoding="utf-8") as tf :
+                self.toks = [line.rstrip("\n").split("\t") for line in tf]
+        return self.toks
+
+    ## ------ give access to feature index, creating it if needed
     def feature_index(self) :
+        if self.fidx is None :
+            if self.binary :
+                self.fidx = {f:i for i,f in enumerate(self.__vocabulary())}
+            else :
+                self.fidx = {}
+                for xseq,_,_ in self.__text_sentences() :
+                    for w in xseq :
+                        for f in w :
+                            if f not in self.fidx :
+                                self.fidx[f] = len(self.fidx)
         return self.fidx
 
+    ## ------ position of the first word of each sentence in the
+    ## ------ rows of csr_matrix(), plus the total number of words
+    def sentence_offsets(self) :
+        if self.binary :
+            return numpy.asarray(self.sent_ptr)
+        lengths = [len(xseq) for xseq,_,_ in self.__text_sentences()]
+        offsets = numpy.zeros(len(lengths)+1, dtype=numpy.int64)
+        numpy.cumsum(lengths, out=offsets[1:])
+        return offsets
+
     ## ------ return dataset as a sparse matrix, plus associated gold labels
     def csr_matrix(self) :
-        rowi = [] # row (example number)
-        colj = [] # column (feature number)
-        data = [] # value (1 or 0 since we use binary features)
-        Y = [] # ground truth
-        nex = 0 # example  counter (each word is one example)
-
-        # for each sentence
-        for xseq,yseq,_ in self.sentences :
-            Y.extend(yseq)
-            for w in xseq :
-                for f in w :
-                    data.append(1)
-                    rowi.append(nex)
-                    colj.append(self.fidx[f]) 
-                # next word           
-                nex += 1
-            
-        X = scipy.sparse.csr_matrix((data, (rowi, colj)))  
+        if self.binary :
+            return self.__binary_csr_matrix()
+
+        X, Y, unknown = text_csr_matrix(list(self.__text_sentences()), self.feature_index(), self.external_index)
+        # count features missing in the index, if it was given
+        if self.external_index :
+            self.unknown_types = len(set(unknown))
+            self.unknown_tokens = len(unknown)
         return X,Y
-                
-    ## ------ iterator to access each sentence in the dataset
-    def instances(self) :
-        for x,y,z in self.sentences :
-            yield x,y,z
+
+    ## ------ sorted list of the labels found in the dataset
+    def label_set(self) :
+        if self.binary :
+            return sorted(self.label_names)
+        return sorted({y for _,yseq,_ in self.__text_sentences() for y in yseq})
+
+    ## ------ iterator over the dataset as a sequence of sparse matrices
+    ## ------ (plus gold labels) of about chunk_size words each, split at
+    ## ------ sentence boundaries. Only one chunk is in memory at a time
+    ## ------ (in text datasets, if the dataset was opened with stream=True)
+    def chunks(self, chunk_size=50000) :
+        if self.binary :
+            first = 0
+            for end in self.sent_ptr[1:] :
+                if end - first >= chunk_size or end == self.sent_ptr[-1] :
+                    yield self.__binary_csr_matrix(first, int(end))
+                    first = int(end)
+            return
+
+        fidx = self.feature_index()
+        chunk = []
+        nwords = 0
+        for sentence in self.__text_sentences() :
+            chunk.append(sentence)
+            nwords += len(sentence[0])
+            if nwords >= chunk_size :
+                yield text_csr_matrix(chunk, fidx)[:2]
+                chunk = []
+                nwords = 0
+        if chunk : yield text_csr_matrix(chunk, fidx)[:2]
+
+    ## ------ id in the given feature index of each feature in the
+    ## ------ dataset vocabulary, or -1 if it is not in the index
+    ## ------ (binary datasets only). An array computed elsewhere for
+    ## ------ the same index may be given, to avoid computing it again
+    def feature_remap(self, remap=None) :
+        if remap is not None :
+            self.remap = remap
+        elif self.remap is None :
+            vocab = self.__vocabulary()
+            self.remap = numpy.fromiter((self.fidx.get(f,-1) for f in vocab), dtype=numpy.int64, count=len(vocab))
+        return self.remap
+
+    ## ------ sparse matrix (plus gold labels) of sentences first..last-1,
+    ## ------ sliced from the memory-mapped arrays (binary datasets only).
+    ## ------ Also returns the dataset ids of the feature occurrences not
+    ## ------ in the given index, if any
+    def sentence_range(self, first, last) :
+        start, end = int(self.sent_ptr[first]), int(self.sent_ptr[last])
+        X,Y = self.__binary_csr_matrix(start, end)
+        unknown = numpy.zeros(0, dtype=numpy.int64)
+        if self.fidx is not None :
+            features = self.features[int(self.token_ptr[start]):int(self.token_ptr[end])]
+            unknown = features[self.remap[features] < 0]
+        return X, Y, unknown
+
+    ## ------ auxiliary for csr_matrix and chunks, on binary datasets.
+    ## ------ Matrix with the words first..last-1 (all by default)
+    def __binary_csr_matrix(self, first=0, last=None) :
+        if last is None : last = len(self.token_ptr)-1
+        Y = numpy.array(self.label_names)[self.labels[first:last]]
+        nex = last - first
+        start, end = int(self.token_ptr[first]), int(self.token_ptr[last])
+        features = self.features[start:end]
+        token_ptr = numpy.asarray(self.token_ptr[first:last+1]) - start
+
+        if self.fidx is None :
+            # arrays are already in CSR layout, one row per word
+            data = numpy.ones(len(features), dtype=numpy.uint8)
+            X = scipy.sparse.csr_matrix((data, features, token_ptr),
+                                        shape=(nex, len(self.__vocabulary())))
+            return X,Y
+
+        # translate dataset feature ids to ids in given index (-1 if unknown)
+        self.feature_remap()
+        cols = self.remap[features]
+        known = cols >= 0
+        if first == 0 and last == len(self.token_ptr)-1 :
+            # every feature in the vocabulary occurs in the dataset
+            self.unknown_types = int(numpy.count_nonzero(self.remap < 0))
+            self.unknown_tokens = int(len(known) - numpy.count_nonzero(known))
+
+        # remove unknown features, and shift row start positions accordingly
+        nknown = numpy.zeros(len(known)+1, dtype=numpy.int64)
+        numpy.cumsum(known, out=nknown[1:])
+        indptr = nknown[token_ptr]
+        indices = cols[known].astype(numpy.int32)
+        if len(indices) < 2**31 : indptr = indptr.astype(numpy.int32)
+        data = numpy.ones(len(indices), dtype=numpy.uint8)
+
+        X = scipy.sparse.csr_matrix((data, indices, indptr), shape=(nex, len(self.fidx)))
+        return X,Y
+
+    ## ------ boolean array telling, for each word, whether it has
+    ## ------ some feature for which given test function is True
+    def has_feature(self, test) :
+        if not self.binary :
+            return numpy.fromiter((any(test(f) for f in w) for xseq,_,_ in self.__text_sentences() for w in xseq),
+                                  dtype=bool)
+
+        # test each feature in the vocabulary once
+        matches = numpy.fromiter((test(f) for f in self.__vocabulary()), dtype=bool)
+        hits = numpy.zeros(len(self.features)+1, dtype=numpy.int64)
+        numpy.cumsum(matches[self.features], out=hits[1:])
+        token_ptr = numpy.asarray(self.token_ptr)
+        return hits[token_ptr[1:]] > hits[token_ptr[:-1]]
+
+    ## ------ Feature selection: keep only the columns of training matrix X
+    ## ------ (with labels Y) passing the given criteria (see select_columns),
+    ## ------ and renumber the feature index accordingly. Returns X with the
+    ## ------ selected columns. Not possible with a hashed index.
+    def select_features(self, X, Y, **criteria) :
+        if not selection_requested(**criteria) : return X
+        if isinstance(self.feature_index(), HashIndex) :
+            print("feature selection is not possible with hashing, ignored", file=sys.stderr)
+            return X
+
+        cols = select_columns(X, Y, **criteria)
+        features = sorted(self.fidx, key=self.fidx.get)
+        self.fidx = {features[c]:i for i,c in enumerate(cols)}
+        # binary datasets must remap their ids to the new index
+        self.remap = None
+        print(f"{len(cols)} of {X.shape[1]} features selected", file=sys.stderr)
+        return X[:,cols]
+
+    ## ------ iterator to access each sentence in the dataset, or
+    ## ------ only to sentences first..last-1, if given
+    def instances(self, first=0, last=None) :
+        if not self.binary :
+            yield from islice(self.__text_sentences(), first, last)
+            return
+
+        vocab = self.__vocabulary()
+        toks = self.__token_info()
+        token_ptr = numpy.asarray(self.token_ptr)
+        if last is None : last = len(self.sent_ptr)-1
+        for s in range(first, last) :
+            first, last = int(self.sent_ptr[s]), int(self.sent_ptr[s+1])
+            xseq = [[vocab[f] for f in self.features[token_ptr[t]:token_ptr[t+1]]]
+                    for t in range(first, last)]
+            yseq = [self.label_names[l] for l in self.labels[first:last]]
+            yield xseq, yseq, toks[first:last]
+
+    ## ------ iterator to access token info (sid, form, span) of the
+    ## ------ words in each sentence, without their features
+    def tokens(self) :
+        if not self.binary :
+            for _,_,z in self.__text_sentences() :
+                yield z
+            return
+
+        toks = self.__token_info()
+        for s in range(len(self.sent_ptr)-1) :
+            yield toks[int(self.sent_ptr[s]):int(self.sent_ptr[s+1])]
+
+
+#-------------------------------------------
+# Feature index for the hashing trick: maps any feature string
+# to one of 2^bits columns with a stable hash, so no vocabulary
+# needs to be stored. It can be used as the fidx of a Dataset
+# or a model, in place of a dict.
+#-------------------------------------------
+class HashIndex :
+
+    ## ------ Constructor. Number of columns is 2^bits
+    def __init__(self, bits) :
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+
+    ## ------ column of a feature
+    def __getitem__(self, f) :
+        return zlib.crc32(f.encode("utf-8")) & self.mask
+
+    def get(self, f, default=None) :
+        return self[f]
+
+    ## ------ every feature has a column
+    def __contains__(self, f) :
+        return True
+
+    def __len__(self) :
+        return 1 << self.bits
+
+
+## ------ Encode a list of sentences (features, labels, token info) as
+## ------ a sparse matrix with one row per word, using given feature
+## ------ index. Features not in the index are ignored. Returns the
+## ------ matrix, gold labels, and the list of ignored features (only
+## ------ if count_unknown is True)
+def text_csr_matrix(sentences, fidx, count_unknown=False) :
+    # number of known features of each word (each word is one example)
+    nex = sum(len(xseq) for xseq,_,_ in sentences)
+    lengths = numpy.fromiter((sum(f in fidx for f in w) for xseq,_,_ in sentences for w in xseq),
+                             dtype=numpy.int64, count=nex)
+    # row start positions
+    indptr = numpy.zeros(nex+1, dtype=numpy.int64)
+    numpy.cumsum(lengths, out=indptr[1:])
+    nfeats = int(indptr[-1])
+    # use 32 bit indices whenever possible, as scipy does
+    if nfeats < 2**31 : indptr = indptr.astype(numpy.int32)
+
+    # column (feature number) of each feature in each word
+    indices = numpy.fromiter((fidx[f] for xseq,_,_ in sentences for w in xseq for f in w if f in fidx),
+                             dtype=numpy.int32, count=nfeats)
+    # value (1 since we use binary features)
+    data = numpy.ones(nfeats, dtype=numpy.uint8)
+    # ground truth
+    Y = [y for _,yseq,_ in sentences for y in yseq]
+
+    unknown = []
+    if count_unknown :
+        unknown = [f for xseq,_,_ in sentences for w in xseq for f in w if f not in fidx]
+
+    X = scipy.sparse.csr_matrix((data, indices, indptr), shape=(nex, len(fidx)))
+    return X, Y, unknown
+
+
+## ------ whether a feature comes from the drug lexicons
+## ------ (see extract_features.py and gazetteer.py)
+def is_lexicon_feature(f) :
+    return f in ("isBrand", "isDrug", "isGroup", "isDrug_n") or f.startswith("gaz")
+
+
+## ------ Choose words to train on: all words with an entity label,
+## ------ and a random sample of the words labeled O, at given rate.
+## ------ O words for which 'keep' is True (if given) are all kept.
+## ------ Returns the selected rows, and a weight for each of them that
+## ------ corrects for the sampling (1/rate for sampled O words, else 1)
+def sample_negatives(Y, rate, keep=None, seed=0) :
+    Y = numpy.asarray(Y)
+    sampled = Y == "O"
+    if keep is not None : sampled &= ~keep
+    rng = numpy.random.default_rng(seed)
+    rows = numpy.flatnonzero(~sampled | (rng.random(len(Y)) < rate))
+    weights = numpy.where(sampled[rows], 1.0/rate, 1.0)
+    return rows, weights
+
+
+## ------ Apply O word sampling (see sample_negatives) to a training
+## ------ matrix of given dataset. If stratify is "lexicon", O words with
+## ------ some lexicon feature are all kept. Returns sampled X, Y and
+## ------ sample weights (None if no sampling is done)
+def sample_training(ds, X, Y, rate, stratify=None) :
+    if rate >= 1.0 : return X, Y, None
+
+    keep = ds.has_feature(is_lexicon_feature) if stratify == "lexicon" else None
+    rows, weights = sample_negatives(Y, rate, keep)
+    nO = int(numpy.count_nonzero(numpy.asarray(Y) == "O"))
+    nkept = nO - (len(Y) - len(rows))
+    print(f"training on {len(rows)} of {len(Y)} words ({nkept} of {nO} O words kept)", file=sys.stderr)
+    return X[rows], numpy.asarray(Y)[rows], weights
+
+
+## ------ Feature selection criteria given in model parameters:
+## ------    min_count     minimum number of occurrences in training data
+## ------    top_k         keep only the k best features according to
+## ------    select        score used for top_k: chi2 (default) or mi
+## ------    single_label  if 1, drop features occurring with only one label
+def selection_params(params) :
+    criteria = {}
+    if 'min_count' in params : criteria['min_count'] = int(params['min_count'])
+    if 'top_k' in params : criteria['top_k'] = int(params['top_k'])
+    if 'select' in params : criteria['score'] = params['select']
+    if 'single_label' in params : criteria['single_label'] = bool(int(params['single_label']))
+    return criteria
+
+
+## ------ whether given criteria would remove any feature
+def selection_requested(min_count=1, top_k=None, score="chi2", single_label=False) :
+    return min_count > 1 or top_k is not None or single_label
+
+
+## ------ Columns of X (with labels Y) to keep, in increasing order:
+## ------ those occurring at least min_count times, with more than one
+## ------ label if single_label is True, and, among them, the top_k with
+## ------ highest chi2 or mutual information (score="mi") with the label
+def select_columns(X, Y, min_count=1, top_k=None, score="chi2", single_label=False) :
+    labels, y = numpy.unique(numpy.asarray(Y), return_inverse=True)
+    n = len(y)
+    # occurrences of each feature with each label
+    L = scipy.sparse.csr_matrix((numpy.ones(n, dtype=numpy.int64), (numpy.arange(n), y)),
+                                shape=(n, len(labels)))
+    F = numpy.asarray((X.T @ L).todense(), dtype=numpy.float64)
+    count = F.sum(axis=1)
+    class_count = numpy.bincount(y, minlength=len(labels)).astype(numpy.float64)
+
+    keep = count >= min_count
+    if single_label : keep &= numpy.count_nonzero(F, axis=1) > 1
+
+    if top_k is not None and top_k < numpy.count_nonzero(keep) :
+        if score == "chi2" : scores = chi2_scores(F, class_count)
+        elif score == "mi" : scores = mi_scores(F, class_count)
+        else :
+            print(f"Invalid feature selection score '{score}'", file=sys.stderr)
+            sys.exit(1)
+        scores[~keep] = -numpy.inf
+        keep = numpy.zeros(len(keep), dtype=bool)
+        keep[numpy.argsort(-scores, kind="stable")[:top_k]] = True
+
+    return numpy.flatnonzero(keep)
+
+
+## ------ chi2 statistic of each feature with the label, given the
+## ------ matrix F of occurrences of each feature with each label, and
+## ------ the number of words with each label (as sklearn chi2 computes it)
+def chi2_scores(F, class_count) :
+    expected = numpy.outer(F.sum(axis=1), class_count / class_count.sum())
+    with numpy.errstate(divide="ignore", invalid="ignore") :
+        terms = numpy.where(expected > 0, (F - expected)**2 / expected, 0.0)
+    return terms.sum(axis=1)
+
+
+## ------ mutual information between the presence of each feature and
+## ------ the label, given the matrix F of occurrences of each feature
+## ------ with each label, and the number of words with each label
+def mi_scores(F, class_count) :
+    total = class_count.sum()
+    p_c = class_count / total
+    p_f = numpy.minimum(F.sum(axis=1, keepdims=True) / total, 1.0)
+
+    mi = numpy.zeros(len(F))
+    # feature present (p11), and feature absent (p01), for each class
+    for p, q in [(F / total, p_f * p_c), ((class_count - F).clip(min=0) / total, (1 - p_f) * p_c)] :
+        with numpy.errstate(divide="ignore", invalid="ignore") :
+            mi += numpy.where((p > 0) & (q > 0), p * numpy.log(p / q), 0.0).sum(axis=1)
+    return mi
+
+
+## ------ directory holding the binary version of a datafile
+def binary_dir(datafile) :
+    return datafile + ".bin"
+
+## ------ whether the binary version of datafile is complete and newer
+## ------ than it. The manifest is the last file written (see write_binary)
+def binary_is_fresh(datafile) :
+    manifest = os.path.join(binary_dir(datafile), "manifest.txt")
+    return os.path.isfile(manifest) and os.path.getmtime(manifest) >= os.path.getmtime(datafile)
+
+
+## ------ read sentences from a text datafile. Yield, for each
+## ------ sentence, features, labels and token info of each word
+def read_sequences(fi):
+    xseq = []
+    yseq = []
+    toks = []
+
+    for line in fi:
+        line = line.strip('\n')
+        if not line:
+            # An empty line means the end of a sentence.
+            # Return accumulated sequences, and reinitialize.
+            yield xseq, yseq, toks
+            xseq = []
+            yseq = []
+            toks = []
+            continue
+
+        # Split the line with TAB characters.
+        fields = line.split('\t')
+
+        # Append the item features to the item sequence.
+        # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
+        toks.append(fields[:4]) # token info (sid, form, span)
+        yseq.append(fields[4])  # label (ground truth)
+        xseq.append(fields[5:]) # features
+
+
+## ------ Convert a text datafile to binary format, in directory
+## ------ datafile.bin:
+## ------    features.npy   int32 feature ids of all words, concatenated
+## ------    token_ptr.npy  offset of the features of each word in features.npy
+## ------    sent_ptr.npy   offset of the first word of each sentence
+## ------    labels.npy     int32 label id of each word
+## ------    vocab.txt      feature strings, one per line, in id order
+## ------    labels.txt     label strings, one per line, in id order
+## ------    tokens.tsv     sid, form, span start and end of each word
+## ------    manifest.txt   name and size of the files above, written last
+## ------ The files are written to a temporary directory, which replaces
+## ------ the previous version only once complete
+def write_binary(datafile) :
+    bindir = binary_dir(datafile)
+    tmpdir = tempfile.mkdtemp(prefix=os.path.basename(bindir)+".", suffix=".tmp",
+                              dir=os.path.dirname(os.path.abspath(bindir)))
+    try :
+        _write_binary_files(datafile, tmpdir)
+    except BaseException :
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        raise
+    os.chmod(tmpdir, 0o755)
+
+    # replace previous version, if any
+    if os.path.isdir(bindir) :
+        olddir = tmpdir + ".old"
+        os.replace(bindir, olddir)
+        os.replace(tmpdir, bindir)
+        shutil.rmtree(olddir)
+    else :
+        os.replace(tmpdir, bindir)
+
+
+## ------ auxiliary for write_binary. Write binary files in given directory
+def _write_binary_files(datafile, tmpdir) :
+    fidx = {}
+    lidx = {}
+    features = array("i")
+    token_ptr = array("q", [0])
+    sent_ptr = array("q", [0])
+    labels = array("i")
+
+    with open(datafile) as df, open(os.path.join(tmpdir,"tokens.tsv"), "w", encoding="utf-8") as tf :
+        for xseq, yseq, toks in read_sequences(df) :
+            for w, y, tk in zip(xseq, yseq, toks) :
+                for f in w :
+                    if f not in fidx : fidx[f] = len(fidx)
+                    features.append(fidx[f])
+                token_ptr.append(len(features))
+                if y not in lidx : lidx[y] = len(lidx)
+                labels.append(lidx[y])
+                print(*tk, sep="\t", file=tf)
+            sent_ptr.append(len(token_ptr)-1)
+
+    # use 32 bit offsets whenever possible, as scipy sparse matrices do
+    ptr_type = numpy.int32 if len(features) < 2**31 else numpy.int64
+    numpy.save(os.path.join(tmpdir,"features.npy"), numpy.frombuffer(features, dtype=numpy.int32))
+    numpy.save(os.path.join(tmpdir,"token_ptr.npy"), numpy.frombuffer(token_ptr, dtype=numpy.int64).astype(ptr_type))
+    numpy.save(os.path.join(tmpdir,"sent_ptr.npy"), numpy.frombuffer(sent_ptr, dtype=numpy.int64))
+    numpy.save(os.path.join(tmpdir,"labels.npy"), numpy.frombuffer(labels, dtype=numpy.int32))
+    with open(os.path.join(tmpdir,"vocab.txt"), "w", encoding="utf-8") as vf :
+        for f in fidx : print(f, file=vf)
+    with open(os.path.join(tmpdir,"labels.txt"), "w", encoding="utf-8") as lf :
+        for l in lidx : print(l, file=lf)
+
+    # written last: the directory is only complete if the manifest exists
+    with open(os.path.join(tmpdir,"manifest.txt"), "w", encoding="utf-8") as mf :
+        for fname in sorted(os.listdir(tmpdir)) :
+            print(fname, os.path.getsize(os.path.join(tmpdir,fname)), sep="\t", file=mf)
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  dataset.py datafile
+## --
+## -- Writes binary version of given (text) datafile
+## --
+
+if __name__ == "__main__" :
+    write_binary(sys.argv[1])
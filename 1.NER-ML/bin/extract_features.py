@@ -2,26 +2,92 @@
 
 import sys, os
 import re
-from xml.dom.minidom import parse
-import spacy
+import functools
+import shutil
+import multiprocessing
+
+from gazetteer import get_gazetteer
+from dataset import write_binary
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+from analyzer import create_analyzer
+from corpus import read_sentences
+from alignment import TokenAlignment, offset_spans
+import profiler
    
-## --------- get tag ----------- 
-##  Find out whether given token is marked as part of an entity in the XML
-def get_label(tks, tke, spans) :
-    for (spanS,spanE,spanT) in spans :
-        if tks==spanS and tke<=spanE+1 : return "B-"+spanT
-        elif tks>spanS and tke<=spanE+1 : return "I-"+spanT
-    return "O"
- 
+## --------- Word type features -----------
+## -- Features that only depend on the token string are computed once
+## -- per distinct word form, and kept in a LRU cache
+
+# maximum number of word forms kept in the cache
+TYPE_CACHE_SIZE = 100000
+
+# patterns used by isAlphaNumDash
+_letter_re = re.compile(r'[a-zA-Z]')
+_number_re = re.compile(r'[0-9]')
+_alnum_dash_re = re.compile(r'^[a-zA-Z0-9-]+$')
+
+#If the token is a mix of letters and numbers and dashes
+def has_letter_and_number_or_dash(t):
+   # Check if string has at least one letter
+   has_letter = _letter_re.search(t) is not None
+
+   # Check if string has at least one number
+   has_number = _number_re.search(t) is not None
+
+   # Check if string has at least one dash
+   has_dash = "-" in t
+
+   # Make sure string only contains allowed characters
+   is_alphanumeric_dash = _alnum_dash_re.match(t) is not None
+
+   # Return true if it has at least one letter AND (at least one number OR at least one dash)
+   return is_alphanumeric_dash and has_letter and (has_number or has_dash)
+
+## -- Returns two tuples of features: those going before the context
+## -- features (form, suffix) and those going after them.
+@functools.lru_cache(maxsize=TYPE_CACHE_SIZE)
+def type_features(t) :
+   head = ("form="+t, "suf3="+t[-3:])
+
+   ### MY FEATURES ###
+   tail = []
+   #Is token all uppercase?
+   if t.isupper():
+      tail.append("isAllUpper")
+
+   #Does token start with a capital letter?
+   if t[0].isupper():
+      tail.append("isCapital")
+
+   #The first 3 characters of the token
+   tail.append("pref3="+t[:3])
+
+   #Is token in list of known brands, drugs, groups or drug_n
+   tail.extend(get_gazetteer().token_flags(t))
+
+   # Add the check to your feature extraction
+   if has_letter_and_number_or_dash(t):
+      tail.append("isAlphaNumDash")
+
+   return head, tuple(tail)
+
+
 ## --------- Feature extractor ----------- 
 ## -- Extract features for each token in given sentence
 
 def extract_sentence_features(tokens) :
 
+   # lexicons are loaded only once per process
+   gazetteer = get_gazetteer()
+   # tag tokens belonging to known multi-token names
+   gazTags = gazetteer.match([tk.text for tk in tokens])
+
    # for each token, generate list of features and add it to the result
    sentenceFeatures = {}
    for i,tk in enumerate(tokens) :
-      tokenFeatures = []
       t = tk.text
       # PoS tag and/or lemma could be used as feature, since spacy 
       # computes them by default
@@ -30,9 +96,10 @@ def extract_sentence_features(tokens) :
       #tag = tk.tag_   # finer PoS. E.g.:  NN (noun singular), NNS (noun plural), 
                        # VB (verb), VBS (verb 3rd person), VBD (verb past tense), ... 
 
-      tokenFeatures.append("form="+t)
-      tokenFeatures.append("suf3="+t[-3:])
+      head, tail = type_features(t)
+      tokenFeatures = list(head)
 
+      # context features, which depend on the position
       if i>0 :
          tPrev = tokens[i-1].text
          tokenFeatures.append("formPrev="+tPrev)
@@ -47,155 +114,151 @@ def extract_sentence_features(tokens) :
       else:
          tokenFeatures.append("EoS")
 
-      ### MY FEATURES ###
+      tokenFeatures.extend(tail)
 
-      #Is token all uppercase?
-      if t.isupper():
-         tokenFeatures.append("isAllUpper")
-      
-      #Does token start with a capital letter?
-      if t[0].isupper():
-         tokenFeatures.append("isCapital")
-   
-      #The first 3 characters of the token
-      tokenFeatures.append("pref3="+t[:3])
-
-      known_brands = read_file_to_list("lists/brand.txt")
-      known_drugs = read_file_to_list("lists/drug.txt")
-      known_groups = read_file_to_list("lists/group.txt")
-      known_drug_n = read_file_to_list("lists/drug_n.txt")
-
-      #Is token in list of known brands
-      if t.lower() in known_brands:
-         tokenFeatures.append("isBrand")
-      
-      #Is token in list of known drugs
-      if t.lower() in known_drugs:
-         tokenFeatures.append("isDrug")
-      
-      #Is token in list of known groups
-      if remove_trailing_s(t.lower()) in remove_trailing_s(known_groups):
-         tokenFeatures.append("isGroup")
-
-      #Is token in list of known drug_n
-      if t.lower() in known_drug_n:
-         tokenFeatures.append("isDrug_n")
-
-      #If the token is a mix of letters and numbers and dashes
-      def has_letter_and_number_or_dash(t):
-         # Check if string has at least one letter
-         has_letter = bool(re.search(r'[a-zA-Z]', t))
-         
-         # Check if string has at least one number
-         has_number = bool(re.search(r'[0-9]', t))
-         
-         # Check if string has at least one dash
-         has_dash = bool(re.search(r'-', t))
-         
-         # Make sure string only contains allowed characters
-         is_alphanumeric_dash = bool(re.match(r'^[a-zA-Z0-9-]+$', t))
-         
-         # Return true if it has at least one letter AND (at least one number OR at least one dash)
-         return is_alphanumeric_dash and has_letter and (has_number or has_dash)
-
-      # Add the check to your feature extraction
-      if has_letter_and_number_or_dash(t):
-         tokenFeatures.append("isAlphaNumDash")
+      #Is token part of a known (possibly multi-token) name
+      if gazTags[i] is not None:
+         tokenFeatures.append("gaz"+gazTags[i])
     
       sentenceFeatures[i] = tokenFeatures
 
-
-    
    return sentenceFeatures
 
+## --------- Feature writer -----------
+## -- Analyze given sentences (sid, text, gold spans) and write
+## -- the features of each token to outf. Return number of word type
+## -- cache hits and misses while extracting them
+
+def write_features(sentences, nlp, outf, batch_size=64, n_process=1) :
+    cache_before = type_features.cache_info()
+
+    # convert the sentences to lists of tokens, in batches. Analyzers
+    # may be lazy, so time also the production of each sentence
+    with profiler.stage("analysis") :
+      docs = nlp.pipe((stext for _,stext,_ in sentences),
+                      batch_size=batch_size, n_process=n_process)
+    docs = profiler.timed_iter("analysis", docs)
+
+    # process each sentence in the file
+    for (sid,stext,spans),tokens in zip(sentences, docs) :
+      print(f"extracting sentence {sid}        \r", end="")
+      with profiler.stage("features") :
+         # extract sentence features
+         features = extract_sentence_features(tokens)
+         # get gold standard tag for each token, from entity offsets
+         tags = TokenAlignment.from_tokens(tokens).bio_labels(spans)
+
+      with profiler.stage("write") :
+         # print features in format expected by CRF/SVM/MEM trainers
+         for i,tk in enumerate(tokens) :
+            tks,tke = tk.idx, tk.idx+len(tk.text)
+            # print feature vector for this token
+            print (sid, tk.text, tks, tke-1, tags[i], "\t".join(features[i]), sep='\t', file=outf)
+
+         # blank line to separate sentences
+         print(file=outf)
+
+    cache_after = type_features.cache_info()
+    return cache_after.hits-cache_before.hits, cache_after.misses-cache_before.misses
+
+
+## --------- Parallel extraction workers -----------
+## -- Each worker process creates its own analyzer (and loads its
+## -- own lexicons), and writes the features of a chunk of
+## -- sentences to a shard file
+
+_worker_nlp = None
+
+def _init_worker(tokenizer, cachedir) :
+    global _worker_nlp
+    _worker_nlp = create_analyzer(tokenizer, cachedir)
+
+def _extract_shard(task) :
+    sentences, shardfile, batch_size = task
+    with open(shardfile, "w") as outf :
+        hits, misses = write_features(sentences, _worker_nlp, outf, batch_size)
+    return shardfile, hits, misses
+
+
 ## --------- Feature extractor ----------- 
 ## -- Extract features for each token in each
 ## -- sentence in given file
 
-def extract_features(datafile, outfile) :
+def extract_features(datafile, outfile, batch_size=64, n_process=1, tokenizer="trf", cachedir=None, workers=1) :
 
-    # open output file
-    outf = open(outfile, "w")
-    
-    # create analyzer. We don't need the parser now, it will be faster if disabled
-    nlp = spacy.load("en_core_web_trf", disable=["parser"])
-    
-    # parse XML file, obtaining a DOM tree
-    tree = parse(datafile)
+    # collect id, text and gold spans of each sentence in the file
+    sentences = []
+    with profiler.stage("parse XML") :
+      for s in read_sentences(datafile) :
+         # discontinuous entities have several (start,end) fragments
+         spans = [(offset_spans(e.offset), e.type) for e in s.entities]
+         sentences.append((s.id, s.text, spans))
 
-    # process each sentence in the file
-    sentences = tree.getElementsByTagName("sentence")
-    for s in sentences :
-      sid = s.attributes["id"].value   # get sentence id
-      print(f"extracting sentence {sid}        \r", end="")
-      spans = []
-      stext = s.attributes["text"].value   # get sentence text
-      entities = s.getElementsByTagName("entity") # get gold standard entities
-      for e in entities :
-         # for discontinuous entities, we only get the first span
-         # (will not work, but there are few of them)
-         (start,end) = e.attributes["charOffset"].value.split(";")[0].split("-")
-         typ =  e.attributes["type"].value
-         spans.append((int(start),int(end),typ))
-
-      # convert the sentence to a list of tokens
-      tokens = nlp(stext)
-      # extract sentence features
-      features = extract_sentence_features(tokens)
-
-      # print features in format expected by CRF/SVM/MEM trainers
-      for i,tk in enumerate(tokens) :
-         # see if the token is part of an entity
-         tks,tke = tk.idx, tk.idx+len(tk.text)
-         # get gold standard tag for this token
-         tag = get_label(tks, tke, spans)
-         # print feature vector for this token
-         print (sid, tk.text, tks, tke-1, tag, "\t".join(features[i]), sep='\t', file=outf)
-
-      # blank line to separate sentences
-      print(file=outf)
-
-    # close output file
-    outf.close()
+    if workers <= 1 :
+      # create analyzer (see util/analyzer.py for available ones). If a cache
+      # directory is given, sentences analyzed in previous runs are reused
+      nlp = create_analyzer(tokenizer, cachedir)
+      with open(outfile, "w") as outf :
+         hits, misses = write_features(sentences, nlp, outf, batch_size, n_process)
+
+    else :
+      # split sentences in consecutive chunks (a few per worker, to
+      # balance load), and extract each chunk to its own shard file
+      nchunks = max(1, min(len(sentences), 4*workers))
+      bounds = [len(sentences)*k//nchunks for k in range(nchunks+1)]
+      tasks = [(sentences[bounds[k]:bounds[k+1]], f"{outfile}.part{k}", batch_size)
+               for k in range(nchunks)]
+
+      # (stages inside the workers are not timed)
+      with profiler.stage("parallel extraction"), \
+           multiprocessing.Pool(workers, _init_worker, (tokenizer, cachedir)) as pool :
+         shards = pool.map(_extract_shard, tasks)
+
+      # each worker has its own word type cache
+      hits = sum(h for _,h,_ in shards)
+      misses = sum(m for _,_,m in shards)
+
+      # merge shards in original sentence order
+      with profiler.stage("merge shards"), open(outfile, "w") as outf :
+         for shardfile,_,_ in shards :
+            with open(shardfile) as sf :
+               shutil.copyfileobj(sf, outf)
+            os.remove(shardfile)
+
+    total = max(1, hits+misses)
+    print(f"word type cache: {hits} hits, {misses} misses ({100*hits/total:.1f}% hit rate)", file=sys.stderr)
+
+    # binary copy of the features, loaded much faster by Dataset
+    with profiler.stage("write binary") :
+      write_binary(outfile)
 
 ## --------- MAIN PROGRAM ----------- 
 ## --
-## -- Usage:  baseline-NER.py target-dir outfile
+## -- Usage:  extract_features.py [--tokenizer=trf|sm|blank|regex] [--cachedir=DIR] [--workers=N]
+## --                             [--profile[=DIR]] datafile outfile [batch_size [n_process]]
 ## --
 ## -- Extracts Drug NE from all XML files in target-dir, and writes
 ## -- corresponding feature vectors to outfile
 ## --
 
 if __name__ == "__main__" :
+    # separate options (--name=value) from positional arguments
+    options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
     # directory with files to process
-    datafile = sys.argv[1]
+    datafile = args[0]
     # file where to store results
-    featfile = sys.argv[2]
-    
-    extract_features(datafile, featfile)
-
-# Helper functions
-
-def read_file_to_list(filename):
-    entries = []
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            for line in file:
-                # Strip whitespace and add non-empty lines to the list
-                line = line.strip()
-                if line:
-                    entries.append(line)
-    except UnicodeDecodeError:
-        # Try another encoding if UTF-8 fails
-        with open(filename, 'r', encoding='latin-1') as file:
-            for line in file:
-                line = line.strip()
-                if line:
-                    entries.append(line)
-    
-    return entries
+    featfile = args[1]
+    # sentences sent to spacy at once, and number of analyzer processes
+    batch_size = int(args[2]) if len(args)>2 else 64
+    n_process = int(args[3]) if len(args)>3 else 1
+    # time each stage, and profile them if a directory is given
+    profiler.enable_from_options(options)
 
-def remove_trailing_s(word):
-    if word and word[-1].lower() == 's':
-        return word[:-1]
-    return word
+    with profiler.stage("extract") :
+      extract_features(datafile, featfile, batch_size, n_process,
+                       tokenizer=options.get("tokenizer", "trf"),
+                       cachedir=options.get("cachedir"),
+                       workers=int(options.get("workers", 1)))
+    profiler.report()
@@ -0,0 +1,143 @@
+#####################################################
+## Class to store the drug lexicons used as features
+#####################################################
+
+import os
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+NERDIR=os.path.dirname(BINDIR) # one level up
+MAINDIR=os.path.dirname(NERDIR) # one level up
+LISTSDIR=os.path.join(MAINDIR,"lists") # down to "lists"
+RESOURCESDIR=os.path.join(MAINDIR,"resources") # down to "resources"
+
+# single instance shared by all callers in this process
+_gazetteer = None
+
+
+class Gazetteer:
+
+    ## --------------------------------------------------
+    ## Constructor: load word lists and multi-token names
+    ## --------------------------------------------------
+    def __init__(self, listsdir=LISTSDIR, resourcesdir=RESOURCESDIR):
+
+        # single-word lists, lowercased, used for isBrand/isDrug/... flags
+        self.brands = set(w.lower() for w in read_file_to_list(os.path.join(listsdir,"brand.txt")))
+        self.drugs = set(w.lower() for w in read_file_to_list(os.path.join(listsdir,"drug.txt")))
+        self.groups = set(w.lower() for w in read_file_to_list(os.path.join(listsdir,"group.txt")))
+        self.drug_n = set(w.lower() for w in read_file_to_list(os.path.join(listsdir,"drug_n.txt")))
+
+        # trie with normalized multi-token names, used for gazB-/gazI- features
+        self.tree = {}
+        for kind, words in [("brand",self.brands), ("drug",self.drugs),
+                            ("group",self.groups), ("drug_n",self.drug_n)] :
+            for w in words :
+                self.add_name(w.split(), kind)
+
+        hsdb = os.path.join(resourcesdir,"HSDB.txt")
+        if os.path.exists(hsdb) :
+            for x in read_file_to_list(hsdb) :
+                self.add_name(x.split(), "drug")
+
+        drugbank = os.path.join(resourcesdir,"DrugBank.txt")
+        if os.path.exists(drugbank) :
+            for x in read_file_to_list(drugbank) :
+                (n,t) = x.rsplit("|",1)
+                self.add_name(n.split(), t.lower())
+
+        # list of gold entities in train data, created by 0a.NER-baseline/bin/run.py
+        drugstrain = os.path.join(resourcesdir,"drugs-train.txt")
+        if os.path.exists(drugstrain) :
+            for x in read_file_to_list(drugstrain) :
+                (_,_,n,t) = x.split("|")
+                self.add_name(n.split(), t.lower())
+
+    ## --------------------------------------------------
+    ## add a name (list of words) to the trie
+    ## --------------------------------------------------
+    def add_name(self, words, kind) :
+        if not words : return
+        node = self.tree
+        for w in words :
+            node = node.setdefault(normalize(w), {})
+        node["END"] = kind
+
+    ## --------------------------------------------------
+    ## get lexicon flags for a single token
+    ## --------------------------------------------------
+    def token_flags(self, t) :
+        flags = []
+        t = t.lower()
+        if t in self.brands : flags.append("isBrand")
+        if t in self.drugs : flags.append("isDrug")
+        # only the token is singularized, group list is kept as it is
+        if remove_trailing_s(t) in self.groups : flags.append("isGroup")
+        if t in self.drug_n : flags.append("isDrug_n")
+        return flags
+
+    ## --------------------------------------------------
+    ## find longest known names in a list of words. Return
+    ## a list with a B-/I- tag (or None) for each word
+    ## --------------------------------------------------
+    def match(self, words) :
+        norm = [normalize(w) for w in words]
+        tags = [None]*len(norm)
+        i = 0
+        while i < len(norm) :
+            node = self.tree
+            kind, end = None, i
+            j = i
+            while j < len(norm) and norm[j] in node :
+                node = node[norm[j]]
+                if "END" in node : kind, end = node["END"], j
+                j += 1
+
+            if kind is None :
+                i += 1
+            else :
+                tags[i] = "B-"+kind
+                for k in range(i+1, end+1) : tags[k] = "I-"+kind
+                i = end + 1
+
+        return tags
+
+
+## --------------------------------------------------
+## get the gazetteer for this process, loading it the first time
+## --------------------------------------------------
+def get_gazetteer() :
+    global _gazetteer
+    if _gazetteer is None :
+        _gazetteer = Gazetteer()
+    return _gazetteer
+
+
+# Helper functions
+
+def normalize(word) :
+    return remove_trailing_s(word.lower())
+
+def read_file_to_list(filename):
+    entries = []
+    try:
+        with open(filename, 'r', encoding='utf-8') as file:
+            for line in file:
+                # Strip whitespace and add non-empty lines to the list
+                line = line.strip()
+                if line:
+                    entries.append(line)
+    except UnicodeDecodeError:
+        # Try another encoding if UTF-8 fails
+        entries = []
+        with open(filename, 'r', encoding='latin-1') as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    entries.append(line)
+
+    return entries
+
+def remove_trailing_s(word):
+    if word and word[-1].lower() == 's':
+        return word[:-1]
+    return word
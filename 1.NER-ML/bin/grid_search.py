@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import sys
 import os
 import csv
 import re
@@ -10,6 +11,11 @@ from collections import defaultdict
 
 import itertools
 
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+import profiler
+
 # Define parameter spaces for each model
 param_spaces = {
     "CRF": {
@@ -110,7 +116,26 @@ def extract_f1_score(model_type):
         print(f"Stats file not found: {stats_file}")
         return None
 
+# Function to get the --profile option to pass to each run: profile
+# statistics of each combination go to their own subfolder of DIR
+def profile_option(options, model_type, i):
+    if "profile" not in options:
+        return ""
+    if not options["profile"]:
+        return "--profile"
+    return "--profile=" + os.path.join(options["profile"], f"{model_type}-{i+1}")
+
+# Usage: grid_search.py [--profile[=DIR]]
+#   With --profile, each run prints time spent in each stage, and the time
+#   of each combination is printed at the end. If DIR is given, each run
+#   also writes its cProfile statistics to a subfolder of DIR.
 def main():
+    # separate options (--name=value), e.g. --profile=DIR
+    options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+    # time each combination (runs are profiled in their own process)
+    if "profile" in options:
+        profiler.enable()
+
     print("Select models to test:")
     print("1. CRF")
     print("2. MEM")
@@ -167,6 +192,7 @@ def main():
                 
                 # Build the command string based on model type
                 param_str = params_to_string(param_dict)
+                profile_opt = profile_option(options, model, i)
                 
                 # Special handling for MEM model
                 if model == "MEM":
@@ -189,6 +215,13 @@ sys.path.append(bin_dir)
 from train import train
 from predict import predict
 
+# time each stage if profiling was requested
+sys.path.append(os.path.join(current_dir, "util"))
+import profiler
+""")
+                        profile_opts = {"profile": profile_opt.partition("=")[2]} if profile_opt else {}
+                        f.write(f"profiler.enable_from_options({profile_opts!r})\n")
+                        f.write("""
 # Parameters with correct types
 params = {
 """)
@@ -206,20 +239,25 @@ params = {
                         
                         f.write("""
 # Train the model
-train(os.path.join(ner_dir, "preprocessed", "train.feat"), 
-      params,
-      os.path.join(ner_dir, "models", "model.mem"))
+with profiler.stage("train MEM"):
+    train(os.path.join(ner_dir, "preprocessed", "train.feat"), 
+          params,
+          os.path.join(ner_dir, "models", "model.mem"))
 
 # Predict using the model
-predict(os.path.join(ner_dir, "preprocessed", "devel.feat"),
-        os.path.join(ner_dir, "models", "model.mem"),
-        os.path.join(ner_dir, "results", "devel-MEM.out"))
+with profiler.stage("predict MEM"):
+    predict(os.path.join(ner_dir, "preprocessed", "devel.feat"),
+            os.path.join(ner_dir, "models", "model.mem"),
+            os.path.join(ner_dir, "results", "devel-MEM.out"))
+
+profiler.report()
 """)
                     
                     # Run the custom script
                     cmd = f"python {temp_script}"
                     print(f"Executing custom MEM script: {cmd}")
-                    exit_code = os.system(cmd)
+                    with profiler.stage(f"{model} combinations"):
+                        exit_code = os.system(cmd)
                     
                     # Clean up the temporary script
                     try:
@@ -229,9 +267,10 @@ predict(os.path.join(ner_dir, "preprocessed", "devel.feat"),
                     
                 else:
                     # For CRF and SVM, use the regular command
-                    cmd = f"python 1.NER-ML\\bin\\run.py train predict {model} {param_str}"
+                    cmd = f"python 1.NER-ML\\bin\\run.py train predict {model} {param_str} {profile_opt}"
                     print(f"Executing: {cmd}")
-                    exit_code = os.system(cmd)
+                    with profiler.stage(f"{model} combinations"):
+                        exit_code = os.system(cmd)
                 
                 if exit_code == 0:
                     print("Command executed successfully")
@@ -279,5 +318,8 @@ predict(os.path.join(ner_dir, "preprocessed", "devel.feat"),
     for model, result in best_params.items():
         print(f"{model}: F1 = {result['f1']}, Parameters = {result['params']}")
 
+    # time spent running the combinations of each model, if --profile was given
+    profiler.report()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,161 @@
+#####################################################
+## Compact format for linear models (MEM, linear SVM)
+#####################################################
+#
+# A trained linear classifier is exported to directory modelfile.lin:
+#    coef.npy        weights, shape (n_features, n_scores), so each
+#                    word row of a CSR matrix is scored with one product
+#    intercept.npy   bias of each score
+#    classes.txt     class labels, one per line
+#    vocab.bin       feature strings, utf-8, sorted, concatenated
+#    vocab_ptr.npy   offset of each feature string in vocab.bin
+#    vocab_col.npy   column of each (sorted) feature string
+#    hash.txt        instead of the vocab files, if the model uses
+#                    feature hashing: number of hash bits
+#
+# All arrays are memory-mapped when loaded, so loading is immediate, and
+# several processes using the same model share its pages. Predicting
+# only needs numpy/scipy, not sklearn.
+
+import os
+import mmap
+import shutil
+from bisect import bisect_left
+
+import numpy
+
+from dataset import HashIndex
+
+
+## ------ directory holding the compact version of a model
+def linear_dir(modelfile) :
+    return modelfile + ".lin"
+
+
+## --------------------------------------------------
+## Export a trained linear classifier (anything with coef_,
+## intercept_ and classes_, predicting the class with the
+## highest score) and its feature index
+## --------------------------------------------------
+def export_linear(tagger, fidx, modelfile) :
+    lindir = linear_dir(modelfile)
+    tmpdir = lindir + ".tmp"
+    shutil.rmtree(tmpdir, ignore_errors=True)
+    os.makedirs(tmpdir)
+
+    numpy.save(os.path.join(tmpdir,"coef.npy"), numpy.ascontiguousarray(tagger.coef_.T))
+    numpy.save(os.path.join(tmpdir,"intercept.npy"), numpy.asarray(tagger.intercept_))
+    with open(os.path.join(tmpdir,"classes.txt"), "w", encoding="utf-8") as cf :
+        for c in tagger.classes_ : print(c, file=cf)
+
+    if isinstance(fidx, HashIndex) :
+        with open(os.path.join(tmpdir,"hash.txt"), "w") as hf :
+            print(fidx.bits, file=hf)
+    else :
+        feats = sorted((f.encode("utf-8"), i) for f,i in fidx.items())
+        ptr = numpy.zeros(len(feats)+1, dtype=numpy.int64)
+        numpy.cumsum([len(f) for f,_ in feats], out=ptr[1:])
+        with open(os.path.join(tmpdir,"vocab.bin"), "wb") as vf :
+            for f,_ in feats : vf.write(f)
+        numpy.save(os.path.join(tmpdir,"vocab_ptr.npy"), ptr)
+        numpy.save(os.path.join(tmpdir,"vocab_col.npy"), numpy.array([i for _,i in feats], dtype=numpy.int32))
+
+    # replace previous version, if any
+    remove_linear(modelfile)
+    os.rename(tmpdir, lindir)
+
+
+## ------ remove compact version of a model, if any
+def remove_linear(modelfile) :
+    shutil.rmtree(linear_dir(modelfile), ignore_errors=True)
+
+
+#-------------------------------------------
+# Feature index stored as a sorted list of feature strings in
+# a memory-mapped file. Features are found with binary search.
+# It can be used as fidx of a Dataset, in place of a dict.
+#-------------------------------------------
+class SortedVocabulary :
+
+    ## ------ Constructor. Map vocabulary files in given directory
+    def __init__(self, lindir) :
+        with open(os.path.join(lindir,"vocab.bin"), "rb") as vf :
+            # mmap does not accept empty files
+            self.blob = mmap.mmap(vf.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(vf.name) else b""
+        self.ptr = numpy.load(os.path.join(lindir,"vocab_ptr.npy"), mmap_mode="r")
+        self.col = numpy.load(os.path.join(lindir,"vocab_col.npy"), mmap_mode="r")
+        # features already looked up
+        self.found = {}
+
+    ## ------ number of features
+    def __len__(self) :
+        return len(self.col)
+
+    ## ------ i-th feature string (utf-8), in sorted order
+    def key(self, i) :
+        return self.blob[self.ptr[i]:self.ptr[i+1]]
+
+    ## ------ column of a feature, or default if not in the vocabulary
+    def get(self, f, default=None) :
+        if f not in self.found :
+            key = f.encode("utf-8")
+            i = bisect_left(_Keys(self), key)
+            self.found[f] = int(self.col[i]) if i < len(self.col) and self.key(i) == key else None
+        col = self.found[f]
+        return default if col is None else col
+
+    def __contains__(self, f) :
+        return self.get(f) is not None
+
+    def __getitem__(self, f) :
+        col = self.get(f)
+        if col is None : raise KeyError(f)
+        return col
+
+
+## ------ view of the sorted vocabulary strings, for bisect
+class _Keys :
+    def __init__(self, vocab) :
+        self.vocab = vocab
+    def __len__(self) :
+        return len(self.vocab)
+    def __getitem__(self, i) :
+        return self.vocab.key(i)
+
+
+#-------------------------------------------
+# Linear classifier loaded from the compact format.
+#-------------------------------------------
+class LinearModel :
+
+    ## ------ Constructor. Load model in modelfile.lin
+    def __init__(self, modelfile) :
+        lindir = linear_dir(modelfile)
+        self.coef = numpy.load(os.path.join(lindir,"coef.npy"), mmap_mode="r")
+        self.intercept = numpy.load(os.path.join(lindir,"intercept.npy"))
+        with open(os.path.join(lindir,"classes.txt"), encoding="utf-8") as cf :
+            self.classes = numpy.array(cf.read().split("\n")[:-1])
+
+        hashfile = os.path.join(lindir,"hash.txt")
+        if os.path.exists(hashfile) :
+            with open(hashfile) as hf :
+                self.fidx = HashIndex(int(hf.read()))
+        else :
+            self.fidx = SortedVocabulary(lindir)
+
+    ## ------ whether given model has been exported
+    @staticmethod
+    def exists(modelfile) :
+        return os.path.isdir(linear_dir(modelfile))
+
+    ## ------ scores of each class for each row of CSR matrix X
+    def decision_function(self, X) :
+        return X @ self.coef + self.intercept
+
+    ## ------ best class for each row of CSR matrix X
+    def predict(self, X) :
+        scores = self.decision_function(X)
+        if scores.shape[1] == 1 :
+            # binary classifiers have a single score, for the second class
+            return self.classes[(scores[:,0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
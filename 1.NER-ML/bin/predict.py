@@ -1,74 +1,227 @@
 #!/usr/bin/env python3
 
-import sys
+import sys, os
+import io
+import multiprocessing
 from MEM import *
 from SVM import *
 from CRF import *
+from dataset import text_csr_matrix
+
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+from alignment import TokenAlignment, bio_entities, offset_string
+import profiler
 
 # --------------------------------------------------
 # extract identified drugs according to BIO tags for each word.
 
 def output_entities(toks, predictions, outf) :
-    inside = False;
-    for k in range(len(predictions)) :
-        y = predictions[k]
-        (sid, form, offS, offE) = toks[k]
-
-        if (y[0]=="B") :
-            entity_form = form
-            entity_start = offS
-            entity_end = offE
-            entity_type = y[2:]
-            inside = True
-        elif (y[0]=="I" and inside) :
-            entity_form += " "+form
-            entity_end = offE
-        elif (y[0]=="O" and inside) :
-            print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|", file=outf)
-            inside = False
-
-    if inside : print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|", file=outf)
+    alignment = TokenAlignment.from_spans([(offS,offE) for (_,_,offS,offE) in toks])
+    for first,last,entity_type in bio_entities(predictions) :
+        sid = toks[first][0]
+        entity_form = " ".join(form for (_,form,_,_) in toks[first:last+1])
+        entity_start, entity_end = alignment.char_span(first, last)
+        print(sid, offset_string(entity_start, entity_end), entity_form, entity_type, sep="|", file=outf)
 
     
-def predict(datafile, modelfile, outputfile):
-    
-    # load data to annotate
-    ds = Dataset(datafile)
+## --------------------------------------------------
+## load a trained model, of the type given by the file extension
+## --------------------------------------------------
+MODEL_TYPES = {".mem" : MEM, ".svm" : SVM, ".crf" : CRF}
+
+def load_model(modelfile) :
+    return MODEL_TYPES[modelfile[-4:].lower()](modelfile)
+
+
+def predict(datafile, modelfile, outputfile, workers=1):
 
-    # load trained model to use
     ext = modelfile[-4:].lower()
-    if ext == ".mem" : model = MEM(modelfile)
-    elif ext == ".svm" : model = SVM(modelfile)
-    elif ext == ".crf" : model = CRF(modelfile)
-    else :
+    if ext not in MODEL_TYPES :
         print(f"Invalid model type '{ext}'")
         sys.exit(1)
-        
+
+    if workers > 1 :
+        predict_parallel(datafile, modelfile, outputfile, workers)
+        return
+
+    # load trained model to use
+    with profiler.stage("load model") :
+        model = load_model(modelfile)
+
+    # load data to annotate. Models working on sparse vectors (MEM, SVM)
+    # encode it with their own feature index
+    fidx = getattr(model, "fidx", None)
+    with profiler.stage("load features") :
+        ds = Dataset(datafile, fidx=fidx)
+
     # open outfile
     outf = open(outputfile, "w")
-    
-    for xseq,_,toks in ds.instances():
-        # process each sentence
-        # each word has a list of features (xseq) for the prediction
-        # plus positional info (toks) to format the output
 
-        # get BIO labels for each word in the sentence
-        predictions = model.predict(xseq)
-        # Convert BIO labels to drugs
-        output_entities(toks, predictions, outf)
+    if fidx is not None :
+        # encode the whole dataset at once, each word is one row
+        with profiler.stage("vectorization") :
+            X,_ = ds.csr_matrix()
+            offsets = ds.sentence_offsets()
+        print(f"{ds.unknown_types} features not in model index ({ds.unknown_tokens} occurrences)", file=sys.stderr)
+
+        # get BIO labels for all words with a single call
+        with profiler.stage("predict") :
+            predictions = model.predict_matrix(X)
+
+        # split labels by sentence, and convert them to drugs
+        with profiler.stage("write") :
+            for k,toks in enumerate(ds.tokens()) :
+                output_entities(toks, predictions[offsets[k]:offsets[k+1]], outf)
+
+    else :
+        for xseq,_,toks in ds.instances():
+            # process each sentence
+            # each word has a list of features (xseq) for the prediction
+            # plus positional info (toks) to format the output
+
+            # get BIO labels for each word in the sentence
+            with profiler.stage("predict") :
+                predictions = model.predict(xseq)
+            # Convert BIO labels to drugs
+            with profiler.stage("write") :
+                output_entities(toks, predictions, outf)
 
     outf.close()
-        
 
-    
+
+## --------- Parallel prediction workers -----------
+## -- Each worker process loads the model once, and tags
+## -- chunks of consecutive sentences, returning the output
+## -- lines for them. Text datasets send the sentences of each
+## -- chunk to the workers. Binary datasets only send the range
+## -- of sentences (and their token info), and each worker slices
+## -- the features from its own memory-mapped copy of the dataset
+
+_worker_model = None
+_worker_dataset = None
+
+def _init_worker(modelfile, datafile=None, remap=None) :
+    global _worker_model, _worker_dataset
+    _worker_model = load_model(modelfile)
+    _worker_dataset = None
+    if datafile is not None :
+        _worker_dataset = Dataset(datafile, fidx=getattr(_worker_model, "fidx", None))
+        # translation to the model index, computed once by the main process
+        if remap is not None : _worker_dataset.feature_remap(remap)
+
+def _predict_chunk(chunk) :
+    model = _worker_model
+    out = io.StringIO()
+    unknown = set()
+    nunknown = 0
+    fidx = getattr(model, "fidx", None)
+
+    if _worker_dataset is not None and fidx is not None :
+        # sentence range of a binary dataset, encoded with the model index
+        first, last, sentences = chunk
+        X,_,missing = _worker_dataset.sentence_range(first, last)
+        unknown.update(missing.tolist())
+        nunknown = len(missing)
+        predictions = model.predict_matrix(X)
+        first = 0
+        for toks in sentences :
+            output_entities(toks, predictions[first:first+len(toks)], out)
+            first += len(toks)
+        return out.getvalue(), unknown, nunknown
+
+    if _worker_dataset is not None :
+        # sentence range of a binary dataset, for models using feature strings
+        first, last, _ = chunk
+        chunk = list(_worker_dataset.instances(first, last))
+
+    if fidx is not None :
+        # encode the whole chunk at once, as predict does for the dataset
+        X,_,missing = text_csr_matrix(chunk, fidx, count_unknown=True)
+        unknown.update(missing)
+        nunknown = len(missing)
+        predictions = model.predict_matrix(X)
+        first = 0
+        for _,_,toks in chunk :
+            output_entities(toks, predictions[first:first+len(toks)], out)
+            first += len(toks)
+    else :
+        for xseq,_,toks in chunk :
+            output_entities(toks, model.predict(xseq), out)
+    return out.getvalue(), unknown, nunknown
+
+
+## ------ consecutive chunks of about chunk_size words of a dataset:
+## ------ lists of sentences for text datasets, and (first, last, token
+## ------ info) sentence ranges for binary datasets
+def _sentence_chunks(ds, chunk_size) :
+    chunk = []
+    nwords = 0
+    first = 0
+    for k,sentence in enumerate(ds.tokens() if ds.binary else ds.instances()) :
+        chunk.append(sentence)
+        nwords += len(sentence if ds.binary else sentence[0])
+        if nwords >= chunk_size :
+            yield (first, k+1, chunk) if ds.binary else chunk
+            chunk = []
+            nwords = 0
+            first = k+1
+    if chunk : yield (first, first+len(chunk), chunk) if ds.binary else chunk
+
+
+## --------------------------------------------------
+## tag datafile with the given number of worker processes. Sentences
+## are sent to the workers in chunks, and their output is written
+## in the original sentence order
+## --------------------------------------------------
+def predict_parallel(datafile, modelfile, outputfile, workers, chunk_size=5000):
+    # text datafiles are read as chunks are sent, not loaded at once
+    ds = Dataset(datafile, stream=True)
+    unknown = set()
+    nunknown = 0
+
+    initargs = (modelfile,)
+    if ds.binary :
+        # translate the dataset features to the model index once, for all workers
+        fidx = getattr(load_model(modelfile), "fidx", None)
+        remap = None
+        if fidx is not None :
+            ds = Dataset(datafile, fidx=fidx)
+            remap = ds.feature_remap()
+        initargs = (modelfile, datafile, remap)
+
+    # (stages inside the workers are not timed)
+    with profiler.stage("parallel prediction"), open(outputfile, "w") as outf, \
+         multiprocessing.Pool(workers, _init_worker, initargs) as pool :
+        for text,unk,nunk in pool.imap(_predict_chunk, _sentence_chunks(ds, chunk_size)) :
+            outf.write(text)
+            unknown.update(unk)
+            nunknown += nunk
+
+    if modelfile[-4:].lower() != ".crf" :
+        print(f"{len(unknown)} features not in model index ({nunknown} occurrences)", file=sys.stderr)
+
+
 ## --------- MAIN PROGRAM ----------- 
 ## --
+## -- Usage:  predict.py [--workers=N] [--profile[=DIR]] datafile modelfile outfile
+## --
 ## -- Extracts Drug NE from all XML files in target-dir
 ## --
 if __name__ == "__main__" :
-    datafile = sys.argv[1]
-    modelfile = sys.argv[2]
-    outfile = sys.argv[3]
-    
-    predict(datafile, modelfile, outfile)
+    # separate options (--name=value) from positional arguments
+    options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
+    datafile = args[0]
+    modelfile = args[1]
+    outfile = args[2]
+
+    # time each stage, and profile them if a directory is given
+    profiler.enable_from_options(options)
+    with profiler.stage("predict") :
+        predict(datafile, modelfile, outfile,
+                workers=int(options.get("workers", 1)))
+    profiler.report()
 
@@ -24,11 +24,45 @@ from predict import predict
 #               More details about parameters at:
 #               https://scikit-learn.org/stable/modules/generated/sklearn.svm.SVC.html
 #               sklearn.linear_model.LogisticRegression page
+#               stream=1: train with SGD (log loss) reading the features in
+#               chunks of chunk_size words (default 50000), so the training
+#               data is never loaded in memory at once. Other parameters:
+#               epochs (default 5), alpha (regularization, default 1e-4),
+#               warm_start=1 (continue training the existing model)
 #    - for SVM: C, kernel, degree, gamma
 #               More details about parameters at: 
 #               https://scikit-learn.org/stable/modules/generated/sklearn.linear_model.LogisticRegression.html
+#               engine: svc (default, exact SVM), liblinear or sgd (linear kernel,
+#               much faster on large data), nystroem or rbf_sampler (approximate
+#               kernel, with n_components features, followed by a linear SVM)
+#               max_iter: iterations of the liblinear/sgd solvers
+#    - for MEM and SVM: hash_bits (if given, features are hashed to
+#               2^hash_bits columns, and no feature index is stored)
+#               o_rate, o_stratify (train on a fraction o_rate of the words
+#               labeled O, reweighted. With o_stratify=lexicon, O words
+#               matching some drug lexicon are all kept)
+#    - for CRF, MEM and SVM: feature selection before training. min_count
+#               (drop features seen less than min_count times), top_k (keep
+#               the top_k features by select=chi2 (default) or mi score),
+#               single_label=1 (drop features seen with only one label).
+#               Not available with hash_bits, nor MEM stream mode
+#    - for extract: batch_size, n_process (sentences sent to spacy at once,
+#               and number of analyzer processes)
 #    Omitted parameters will receive a default value
 #    Parametres may be mixed, each model will select its own.
+#  Options:
+#    --tokenizer=NAME  analyzer used to split sentences in tokens when
+#               extracting features: trf (default), sm, blank, regex
+#               (see util/analyzer.py)
+#    --cachedir=DIR  where analyzed sentences are cached, so they are not
+#               analyzed again in later runs (default: cache in main folder)
+#    --no-cache  do not use the cache of analyzed sentences
+#    --workers=N  number of processes used to extract features, and to
+#               tag sentences with the trained models, in parallel
+#    --profile[=DIR]  print time spent in each stage (XML parsing, analysis,
+#               features, vectorization, fit, predict, evaluation...). If DIR
+#               is given, each step is also profiled with cProfile, and the
+#               breakdown and .prof files are written to DIR
 #
 #  Examples:
 #
@@ -50,6 +84,9 @@ from predict import predict
 #      # the order of the arguments is not relevant, so the line below is equivalent to the previous one
 #      python3 run.py kernel=rbf CRF extract C=10 predict SVM max_iterations=50 train
 #
+#      # Extract features using only a tokenizer, without loading the transformer
+#      python3 run.py extract --tokenizer=regex
+#
 
 BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
 NERDIR=os.path.dirname(BINDIR) # one level up
@@ -59,32 +96,51 @@ UTILDIR=os.path.join(MAINDIR,"util") # down to "util"
 
 sys.path.append(UTILDIR)
 from evaluator import evaluate
+import profiler
 
-# extract training hyperparameters from command line
+# extract options and training hyperparameters from command line
 print("read params")
+options = {}
 params = {}
 for p in sys.argv[1:]:
-    if "=" in p:
+    if p.startswith("--"):
+        opt,_,val = p[2:].partition("=")
+        options[opt] = val
+    elif "=" in p:
         par,val = p.split("=")
         params[par] = val
+tokenizer = options["tokenizer"] if "tokenizer" in options else "trf"
+# analyzed sentences are cached in MAINDIR/cache unless --no-cache is given
+cachedir = options["cachedir"] if "cachedir" in options else os.path.join(MAINDIR,"cache")
+if "no-cache" in options : cachedir = None
+workers = int(options["workers"]) if "workers" in options else 1
+profiler.enable_from_options(options)
 
 # if feature extraction is required, do it
 if "extract" in sys.argv[1:] :
+    batch_size = int(params['batch_size']) if 'batch_size' in params else 64
+    n_process = int(params['n_process']) if 'n_process' in params else 1
     # if test is required, extract features from test
     if "test" in sys.argv[1:] :
         print("Extracting features for test...")
-        extract_features(os.path.join(DATADIR,"test.xml"), 
-                         os.path.join(NERDIR, "preprocessed","test.feat"))
+        with profiler.stage("extract test") :
+            extract_features(os.path.join(DATADIR,"test.xml"), 
+                             os.path.join(NERDIR, "preprocessed","test.feat"),
+                             batch_size, n_process, tokenizer, cachedir, workers)
 
     else : # otherwise, extract features for train and devel
         os.makedirs(os.path.join(NERDIR, "preprocessed"), exist_ok=True)
         # convert datasets to feature vectors
         print("Extracting features for train...")
-        extract_features(os.path.join(DATADIR,"train.xml"),
-                         os.path.join(NERDIR,"preprocessed","train.feat"))
+        with profiler.stage("extract train") :
+            extract_features(os.path.join(DATADIR,"train.xml"),
+                             os.path.join(NERDIR,"preprocessed","train.feat"),
+                             batch_size, n_process, tokenizer, cachedir, workers)
         print("Extracting features for devel...")
-        extract_features(os.path.join(DATADIR,"devel.xml"), 
-                         os.path.join(NERDIR,"preprocessed","devel.feat"))
+        with profiler.stage("extract devel") :
+            extract_features(os.path.join(DATADIR,"devel.xml"), 
+                             os.path.join(NERDIR,"preprocessed","devel.feat"),
+                             batch_size, n_process, tokenizer, cachedir, workers)
 
     
 # for each required model, see if training or prediction are required
@@ -95,30 +151,37 @@ for model in ["CRF", "SVM", "MEM"] :
         os.makedirs(os.path.join(NERDIR,"models"), exist_ok=True)
         # train model
         print(f"Training {model} model...")
-        train(os.path.join(NERDIR,"preprocessed","train.feat"), params,
-              os.path.join(NERDIR,"models","model."+ model.lower()))
+        with profiler.stage(f"train {model}") :
+            train(os.path.join(NERDIR,"preprocessed","train.feat"), params,
+                  os.path.join(NERDIR,"models","model."+ model.lower()))
         
     if "predict" in sys.argv[1:] :    
         os.makedirs(os.path.join(NERDIR,"results"), exist_ok=True)
         if "test" in sys.argv[1:] :
             # run model on test data and evaluate results
             print(f"Running {model} model...")
-            predict(os.path.join(NERDIR,"preprocessed","test.feat"),
-                    os.path.join(NERDIR,"models","model."+model),
-                    os.path.join(NERDIR,"results","test-"+model+".out"))
-            evaluate("NER", os.path.join(DATADIR,"test.xml"),
-                     os.path.join(NERDIR,"results","test-"+model+".out"),
-                     os.path.join(NERDIR,"results","test-"+model+".stats"))
+            with profiler.stage(f"predict {model}") :
+                predict(os.path.join(NERDIR,"preprocessed","test.feat"),
+                        os.path.join(NERDIR,"models","model."+model),
+                        os.path.join(NERDIR,"results","test-"+model+".out"),
+                        workers)
+            with profiler.stage(f"evaluate {model}") :
+                evaluate("NER", os.path.join(DATADIR,"test.xml"),
+                         os.path.join(NERDIR,"results","test-"+model+".out"),
+                         os.path.join(NERDIR,"results","test-"+model+".stats"))
                          
         else :
             # run model on devel data and evaluate results
             print(f"Running {model} model...")
-            predict(os.path.join(NERDIR,"preprocessed","devel.feat"),
-                   os.path.join(NERDIR,"models","model."+model),
-                   os.path.join(NERDIR,"results","devel-"+model+".out"))
-            evaluate("NER", os.path.join(DATADIR,"devel.xml"),
-                     os.path.join(NERDIR,"results","devel-"+model+".out"),
-                     os.path.join(NERDIR,"results","devel-"+model+".stats"))
+            with profiler.stage(f"predict {model}") :
+                predict(os.path.join(NERDIR,"preprocessed","devel.feat"),
+                       os.path.join(NERDIR,"models","model."+model),
+                       os.path.join(NERDIR,"results","devel-"+model+".out"),
+                       workers)
+            with profiler.stage(f"evaluate {model}") :
+                evaluate("NER", os.path.join(DATADIR,"devel.xml"),
+                         os.path.join(NERDIR,"results","devel-"+model+".out"),
+                         os.path.join(NERDIR,"results","devel-"+model+".stats"))
 
             '''
             # run model on train data and evaluate results
@@ -130,3 +193,6 @@ for model in ["CRF", "SVM", "MEM"] :
                      os.path.join(NERDIR,"results","train-"+model+".out"),
                      os.path.join(NERDIR,"results","train-"+model+".stats"))
             '''
+
+# print time spent in each stage, if --profile was given
+profiler.report()
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
-import sys
+import sys, os
 from MEM import *
 from SVM import *
 from CRF import *
 
+BINDIR=os.path.abspath(os.path.dirname(__file__)) # location of this file
+MAINDIR=os.path.dirname(os.path.dirname(BINDIR)) # two levels up
+sys.path.append(os.path.join(MAINDIR,"util"))
+import profiler
+
 def train(datafile, params, modelfile) :
     # Create an empty model of the appropriate type
     ext = modelfile[-4:].lower()
@@ -20,16 +25,24 @@ def train(datafile, params, modelfile) :
 
 
 if __name__ == "__main__" :
+    # separate options (--name=value) from positional arguments
+    options = dict(a[2:].partition("=")[::2] for a in sys.argv[1:] if a.startswith("--"))
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
     # get file where model will be written
-    datafile = sys.argv[1]
-    modelfile = sys.argv[2]
+    datafile = args[0]
+    modelfile = args[1]
     
     # get parameters in line.  e.g. C=10 kernel=rbf degree=2
     params = {}
-    pars = sys.argv[3:]
+    pars = args[2:]
     for x in pars:
         par,val = x.split("=")
         params[par] = val
 
-    # train model and store in given filename
-    train(datafile, params, modelfile)
+    # train model and store in given filename, timing each
+    # stage if --profile[=DIR] is given
+    profiler.enable_from_options(options)
+    with profiler.stage("train") :
+        train(datafile, params, modelfile)
+    profiler.report()
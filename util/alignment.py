@@ -0,0 +1,97 @@
+#! /usr/bin/python3
+
+# Alignment between character offsets in a sentence and its tokens.
+# Token boundaries are kept in sorted arrays, so the tokens covered by a
+# character span are found with binary search instead of scanning the
+# whole sentence. Used to create gold BIO labels from corpus offsets, and
+# to convert token tags back to offsets, in the same way everywhere.
+#
+# Character offsets follow the DDI corpus convention: "start-end" with
+# both ends included, and discontinuous entities as "s1-e1;s2-e2;..."
+
+from bisect import bisect_left, bisect_right
+
+
+## --------------------------------------------------
+## parse a DDI charOffset string into a list of (start,end) spans
+## --------------------------------------------------
+def offset_spans(offset) :
+    spans = []
+    for frag in offset.split(";") :
+        (start,end) = frag.split("-")
+        spans.append((int(start),int(end)))
+    return spans
+
+
+## --------------------------------------------------
+## format a (start,end) span as a DDI charOffset string
+## --------------------------------------------------
+def offset_string(start, end) :
+    return f"{start}-{end}"
+
+
+## --------------------------------------------------
+## find entities in a sequence of BIO tags. Return a list of
+## (first, last, type) token ranges. I- tags not following a
+## B- or I- tag are ignored.
+## --------------------------------------------------
+def bio_entities(tags) :
+    entities = []
+    first = None
+    for k,y in enumerate(tags) :
+        if y[0] == "B" :
+            if first is not None : entities.append((first, k-1, etype))
+            first, etype = k, y[2:]
+        elif y[0] == "O" and first is not None :
+            entities.append((first, k-1, etype))
+            first = None
+    if first is not None : entities.append((first, len(tags)-1, etype))
+    return entities
+
+
+class TokenAlignment :
+
+    ## --------------------------------------------------
+    ## Constructor: token start offsets, and end offsets (not included)
+    ## --------------------------------------------------
+    def __init__(self, starts, ends) :
+        self.starts = list(starts)
+        self.ends = list(ends)
+
+    ## ------ alignment for a list of tokens with .idx and .text
+    @classmethod
+    def from_tokens(cls, tokens) :
+        return cls([tk.idx for tk in tokens],
+                   [tk.idx+len(tk.text) for tk in tokens])
+
+    ## ------ alignment for (start, end) spans with end included
+    @classmethod
+    def from_spans(cls, spans) :
+        return cls([int(s) for s,_ in spans],
+                   [int(e)+1 for _,e in spans])
+
+    ## ------ range of tokens fully inside span (start,end), end included.
+    ## ------ Returns (first, last) token indices, empty if first > last
+    def token_range(self, start, end) :
+        first = bisect_left(self.starts, start)
+        last = bisect_right(self.ends, end+1) - 1
+        return first, last
+
+    ## ------ character span (start,end) covered by tokens first..last
+    def char_span(self, first, last) :
+        return self.starts[first], self.ends[last]-1
+
+    ## ------ BIO label of each token, given a list of entities, each
+    ## ------ a list of (start,end) fragments and a type. A token is
+    ## ------ labeled B if it starts the entity, I if it is inside any
+    ## ------ of its fragments. If entities overlap, the first one wins.
+    def bio_labels(self, entities) :
+        labels = [None]*len(self.starts)
+        for fragments,etype in entities :
+            estart = fragments[0][0]
+            for start,end in fragments :
+                first, last = self.token_range(start, end)
+                for k in range(first, last+1) :
+                    if labels[k] is None :
+                        labels[k] = ("B-" if self.starts[k]==estart else "I-") + etype
+        return [l if l is not None else "O" for l in labels]
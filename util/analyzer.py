@@ -0,0 +1,351 @@
+#! /usr/bin/python3
+
+# Text analyzers used to split sentences into tokens. All of them provide
+# a 'pipe' method yielding, for each given text, a sequence of tokens with
+# 'text' and 'idx' (start offset) attributes, as spacy Doc objects do.
+#
+#   trf   : spacy en_core_web_trf (transformer, slow)
+#   sm    : spacy en_core_web_sm
+#   blank : spacy.blank("en"), tokenizer only
+#   regex : pure python tokenizer reproducing spacy English tokenization,
+#           without importing spacy at all
+
+import sys
+import re
+from collections import namedtuple
+
+ANALYZERS = ["trf", "sm", "blank", "regex"]
+
+SPACY_MODELS = { "trf" : "en_core_web_trf",
+                 "sm" : "en_core_web_sm",
+                 "blank" : "blank:en" }
+
+# token as produced by the regex tokenizer
+Token = namedtuple("Token", ["text", "idx"])
+
+
+## --------------------------------------------------
+## create an analyzer of the given kind. If a cache directory
+## is given, spacy analyses are stored there and reused
+## --------------------------------------------------
+def create_analyzer(name="trf", cachedir=None) :
+    if name in SPACY_MODELS and cachedir is not None :
+        from doc_cache import CachedAnalyzer
+        return CachedAnalyzer(name, cachedir)
+    elif name in SPACY_MODELS : return SpacyAnalyzer(name)
+    elif name == "regex" : return RegexTokenizer()
+    else :
+        print(f"Invalid tokenizer '{name}'. Please specify one of {', '.join(ANALYZERS)}.", file=sys.stderr)
+        sys.exit(1)
+
+
+########################################################
+## Analyzer based on a spacy pipeline
+########################################################
+class SpacyAnalyzer :
+
+    def __init__(self, name) :
+        import spacy
+
+        self.name = name
+        self.model = SPACY_MODELS[name]
+        # We don't need the parser, it will be faster if disabled
+        self.nlp = spacy.load(self.model, disable=["parser"])
+
+    ## ------ analyze given texts, in batches
+    def pipe(self, texts, batch_size=64, n_process=1) :
+        return self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+
+########################################################
+## Tokenizer following the same prefix/suffix/infix rules
+## as spacy English tokenizer, written with plain regexes
+########################################################
+
+_lower = r"a-zß-öø-ÿā-ſα-ω"
+_upper = r"A-ZÀ-ÖØ-ÞĀ-žΑ-Ω"
+_alpha = _lower + _upper
+_punct = r"… …… , : ; \! \? ¿ ؟ ¡ \( \) \[ \] \{ \} < > _ # \* & 。 ？ ！ ， 、 ； ： ～ · । ، ۔ ؛ ٪"
+_quotes = r'\' " ” “ ` ‘ ´ ’ ‚ , „ » « 「 」 『 』 （ ） 〔 〕 【 】 《 》 〈 〉 〈 〉 ⟦ ⟧'
+_currency = r"\$ £ € ¥ ฿ US\$ C\$ A\$ ₽ ₴ ₠ ₡ ₢ ₣ ₤ ₥ ₦ ₧ ₨ ₩ ₪ ₫ ₭ ₮ ₯ ₰ ₱ ₲ ₳ ₵ ₶ ₷ ₸ ₹ ₺ ₻ ₼ ₾ ₿"
+_units = ("km km² km³ m m² m³ dm dm² dm³ cm cm² cm³ mm mm² mm³ ha µm nm yd in ft "
+          "kg g mg µg t lb oz m/s km/h kmh mph hPa Pa mbar mb MB kb KB gb GB tb TB T G M K %")
+_hyphens = "- – — -- --- —— ~"
+_icons = r"¦©®°℀-⅏←-⇿⌀-⏿─-➿⬀-⯿"
+
+_list_punct = _punct.split()
+_list_quotes = _quotes.split()
+_list_currency = _currency.split()
+_list_ellipses = [r"\.\.+", "…"]
+_list_icons = [f"[{_icons}]"]
+_concat_quotes = _quotes.replace(" ", "")
+
+_prefixes = (["§", "%", "=", "—", "–", r"\+(?![0-9])"] + _list_punct + _list_ellipses
+             + _list_quotes + _list_currency + _list_icons)
+
+_suffixes = (_list_punct + _list_ellipses + _list_quotes + _list_icons
+             + ["'s", "'S", "’s", "’S", "—", "–"]
+             + [r"(?<=[0-9])\+",
+                r"(?<=°[FfCcKk])\.",
+                r"(?<=[0-9])(?:{c})".format(c="|".join(_list_currency)),
+                r"(?<=[0-9])(?:{u})".format(u=_units.replace(" ", "|")),
+                r"(?<=[0-9{al}{e}{p}(?:{q})])\.".format(al=_lower, e=r"%²\-\+",
+                                                         q=_concat_quotes, p="|".join(_list_punct)),
+                r"(?<=[{au}][{au}])\.".format(au=_upper)])
+
+_infixes = (_list_ellipses + _list_icons
+            + [r"(?<=[0-9])[+\-\*^](?=[0-9-])",
+               r"(?<=[{al}{q}])\.(?=[{au}{q}])".format(al=_lower, au=_upper, q=_concat_quotes),
+               r"(?<=[{a}]),(?=[{a}])".format(a=_alpha),
+               r"(?<=[{a}0-9])(?:{h})(?=[{a}])".format(a=_alpha, h=_hyphens.replace(" ", "|")),
+               r"(?<=[{a}0-9])[:<>=/](?=[{a}])".format(a=_alpha)])
+
+_prefix_re = re.compile("|".join("^" + p for p in _prefixes))
+_suffix_re = re.compile("|".join(s + "$" for s in _suffixes))
+_infix_re = re.compile("|".join(_infixes))
+_url_re = re.compile(r"^(?:(?:[\w\+\-\.]{2,})://)?(?:\S+(?::\S*)?@)?"
+                     r"(?:(?:[A-Za-z0-9\u00a1-\uffff][A-Za-z0-9\u00a1-\uffff_-]{0,62})?[A-Za-z0-9\u00a1-\uffff]\.)+"
+                     r"(?:[a-z\u00df-\u00f6\u00f8-\u00ff]{2,63})(?::\d{2,5})?(?:[/?#]\S*)?$")
+
+
+## ------ special cases (subset of spacy English tokenizer exceptions)
+def _special_cases() :
+    specials = {}
+    # abbreviations kept as a single token
+    for abbr in ["Adm.", "Ak.", "Ala.", "Apr.", "Ariz.", "Ark.", "Aug.", "Bros.", "Calif.", "Co.",
+                 "Colo.", "Conn.", "Corp.", "D.C.", "Dec.", "Del.", "Dr.", "E.G.", "E.g.", "Feb.",
+                 "Fla.", "Ga.", "Gen.", "Gov.", "I.E.", "I.e.", "Ia.", "Id.", "Ill.", "Inc.", "Ind.",
+                 "Jan.", "Jr.", "Jul.", "Jun.", "Kan.", "Kans.", "Ky.", "La.", "Ltd.", "Mar.",
+                 "Mass.", "Md.", "Messrs.", "Mich.", "Minn.", "Miss.", "Mo.", "Mont.", "Mr.",
+                 "Mrs.", "Ms.", "Mt.", "N.C.", "N.D.", "N.H.", "N.J.", "N.M.", "N.Y.", "Neb.",
+                 "Nebr.", "Nev.", "Nov.", "Oct.", "Okla.", "Ore.", "Pa.", "Ph.D.", "Prof.", "Rep.",
+                 "Rev.", "S.C.", "Sen.", "Sep.", "Sept.", "St.", "Tenn.", "Va.", "Wash.", "Wis.",
+                 "a.m.", "co.", "e.g.", "i.e.", "p.m.", "v.s.", "vs.", "°C.", "°F.", "°K.", "°c.",
+                 "°f.", "°k.", "ä.", "ö.", "ü.", "and/or", "'s", "'S", "''", "’’"] :
+        specials[abbr] = [abbr]
+    for h in range(1,13) :
+        specials[f"{h}a.m."] = [str(h), "a.m."]
+        specials[f"{h}p.m."] = [str(h), "p.m."]
+    # single letters followed by a dot
+    for c in "abcdefghijklmnopqrstuvwxyz" :
+        specials[c+"."] = [c+"."]
+    # emoticons
+    for emo in ["(*_*)", "(-8", "(-:", "(-;", "(-_-)", "(._.)", "(:", "(;", "(=", "(>_<)", "(^_^)",
+                "(¬_¬)", ")-:", "):", "-_-", "-__-", "._.", "0.0", "0.o", "0_0", "8)", "8-)",
+                ":'(", ":')", ":'-(", ":'-)", ":(", ":((", ":(((", ":()", ":)", ":))", ":)))",
+                ":*", ":-(", ":-((", ":-(((", ":-)", ":-))", ":-)))", ":-*", ":-/", ":-0", ":-3",
+                ":->", ":-]", ":-|", ":-}", ":/", ":0", ":1", ":3", ":>", ":D", ":O", ":P", ":]",
+                ":o", ":p", ":|", ":}", ":’(", ":’)", ":’-(", ":’-)", ";)", ";-)", ";_;", "<.<",
+                "</3", "<3", "<33", "<333", "=(", "=)", "=/", "=3", "=D", "=[", "=]", "=|", ">.<",
+                ">.>", ">:(", "><(((*>", "@_@", "XD", "[-:", "[:", "[=", "\\\")", "]=", "^_^",
+                "^__^", "^___^", "xD", "xDD", "o.0", "o.O", "o.o", "O.O", "O.o", "V.V", "v.v"] :
+        specials[emo] = [emo]
+    # negative contractions
+    for verb in ["do", "does", "did", "is", "are", "was", "were", "has", "have", "had",
+                 "could", "would", "should", "must", "might", "need", "dare", "ca", "wo",
+                 "sha", "ai"] :
+        for v in [verb, verb.capitalize()] :
+            specials[v+"n't"] = [v, "n't"]
+            specials[v+"n’t"] = [v, "n’t"]
+            specials[v+"nt"] = [v, "nt"]
+    specials["cannot"] = ["can", "not"]
+    specials["Cannot"] = ["Can", "not"]
+    return specials
+
+_specials = _special_cases()
+
+
+class RegexTokenizer :
+
+    def __init__(self) :
+        self.name = "regex"
+        self.model = "regex"
+        # tokens for each whitespace-delimited span seen so far
+        self.cache = {}
+
+    ## ------ analyze given texts. batch_size and n_process are
+    ## ------ accepted for compatibility, but not needed
+    def pipe(self, texts, batch_size=64, n_process=1) :
+        for text in texts :
+            yield self.tokenize(text)
+
+    ## ------ split text in tokens, with their offsets
+    def tokenize(self, text) :
+        tokens = []
+        if not text : return tokens
+
+        # find spans of whitespace and non-space characters, ignoring
+        # spans that are exactly ' ' (as spacy does)
+        start = 0
+        in_ws = text[0].isspace()
+        for i,c in enumerate(text) :
+            if c.isspace() != in_ws :
+                if start < i : self._add_span(text[start:i], start, tokens)
+                start = i+1 if c == ' ' else i
+                in_ws = not in_ws
+        if start < len(text) :
+            self._add_span(text[start:], start, tokens)
+
+        return self._merge_specials(tokens)
+
+    ## ------ add tokens for a span without whitespace, using cache if possible
+    def _add_span(self, span, offset, tokens) :
+        if span not in self.cache :
+            pieces = []
+            self._split_span(span, 0, pieces)
+            self.cache[span] = pieces
+        for tk in self.cache[span] :
+            tokens.append(Token(tk.text, offset+tk.idx))
+
+    ## ------ split a span without whitespace in tokens
+    def _split_span(self, span, offset, tokens, specials=_specials) :
+        if span in specials :
+            self._add_special(span, offset, tokens)
+            return
+
+        # strip prefixes and suffixes
+        prefixes = []
+        suffixes = []
+        last_size = 0
+        while span and len(span) != last_size :
+            if span in specials : break
+            last_size = len(span)
+            m = _prefix_re.search(span)
+            pre_len = m.end() if m else 0
+            if pre_len :
+                prefix, minus_pre = span[:pre_len], span[pre_len:]
+                if minus_pre and minus_pre in specials :
+                    span = minus_pre
+                    prefixes.append(prefix)
+                    break
+            m = _suffix_re.search(span[pre_len:])
+            suf_len = m.end()-m.start() if m else 0
+            if suf_len :
+                suffix, minus_suf = span[-suf_len:], span[:-suf_len]
+                if minus_suf and minus_suf in specials :
+                    span = minus_suf
+                    suffixes.append(suffix)
+                    break
+            if pre_len and suf_len and pre_len + suf_len <= len(span) :
+                span = span[pre_len:-suf_len]
+                prefixes.append(prefix)
+                suffixes.append(suffix)
+            elif pre_len :
+                span = minus_pre
+                prefixes.append(prefix)
+            elif suf_len :
+                span = minus_suf
+                suffixes.append(suffix)
+
+        for p in prefixes :
+            tokens.append(Token(p, offset))
+            offset += len(p)
+
+        if span :
+            if span in specials :
+                self._add_special(span, offset, tokens)
+            elif _url_re.match(span) :
+                tokens.append(Token(span, offset))
+            else :
+                # split on infixes
+                start = 0
+                for m in _infix_re.finditer(span) :
+                    if m.start() == 0 : continue
+                    if m.start() != start : tokens.append(Token(span[start:m.start()], offset+start))
+                    if m.start() != m.end() : tokens.append(Token(m.group(), offset+m.start()))
+                    start = m.end()
+                if span[start:] : tokens.append(Token(span[start:], offset+start))
+            offset += len(span)
+
+        for s in reversed(suffixes) :
+            tokens.append(Token(s, offset))
+            offset += len(s)
+
+    ## ------ special cases containing punctuation (e.g. "):") are split by
+    ## ------ the affix rules. Merge back the tokens forming one of them.
+    def _merge_specials(self, tokens) :
+        if len(tokens) < 2 : return tokens
+        result = []
+        i = 0
+        while i < len(tokens) :
+            if tokens[i].text not in _affix_special_starts :
+                result.append(tokens[i])
+                i += 1
+                continue
+            for n in range(min(_max_affix_special, len(tokens)-i), 1, -1) :
+                texts = tuple(tk.text for tk in tokens[i:i+n])
+                if texts in _affix_specials and \
+                   tokens[i+n-1].idx + len(texts[-1]) - tokens[i].idx == sum(len(t) for t in texts) :
+                    self._add_special(_affix_specials[texts], tokens[i].idx, result)
+                    i += n
+                    break
+            else :
+                result.append(tokens[i])
+                i += 1
+        return result
+
+    ## ------ add tokens for a special case
+    def _add_special(self, span, offset, tokens) :
+        for piece in _specials[span] :
+            tokens.append(Token(piece, offset))
+            offset += len(piece)
+
+
+# special cases that the affix rules would split, indexed by the
+# tokens they would be split into
+_affix_specials = {}
+for _key in _specials :
+    _pieces = []
+    RegexTokenizer()._split_span(_key, 0, _pieces, specials={})
+    if len(_pieces) > 1 :
+        _affix_specials[tuple(tk.text for tk in _pieces)] = _key
+_affix_special_starts = set(k[0] for k in _affix_specials)
+_max_affix_special = max(len(k) for k in _affix_specials)
+
+
+## --------------------------------------------------
+## Compare token boundaries produced by the given analyzer
+## with those of a reference one. Print differing sentences
+## and return the number of sentences with differences.
+## --------------------------------------------------
+def parity(datafile, name, reference="trf", outf=sys.stdout) :
+    from corpus import read_sentences
+
+    texts = [(s.id, s.text) for s in read_sentences(datafile)]
+
+    ref = create_analyzer(reference)
+    tested = create_analyzer(name)
+
+    ndiff = 0
+    for (sid,stext),d1,d2 in zip(texts,
+                                 ref.pipe(t for _,t in texts),
+                                 tested.pipe(t for _,t in texts)) :
+        b1 = [(tk.idx, tk.idx+len(tk.text)) for tk in d1]
+        b2 = [(tk.idx, tk.idx+len(tk.text)) for tk in d2]
+        if b1 != b2 :
+            ndiff += 1
+            only1 = [stext[s:e] for s,e in b1 if (s,e) not in b2]
+            only2 = [stext[s:e] for s,e in b2 if (s,e) not in b1]
+            print(sid, reference+":", only1, name+":", only2, sep="\t", file=outf)
+
+    print(f"{ndiff} of {len(texts)} sentences with different token boundaries", file=outf)
+    return ndiff
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  analyzer.py datafile tokenizer [reference]
+## --
+## -- Reports sentences in datafile where the token boundaries given by
+## -- 'tokenizer' differ from those of 'reference' (default: trf)
+## --
+
+if __name__ == "__main__" :
+    if len(sys.argv) < 3 :
+        print(f"usage:  analyzer.py datafile ({'|'.join(ANALYZERS)}) [reference]")
+        sys.exit(0)
+
+    datafile = sys.argv[1]
+    name = sys.argv[2]
+    reference = sys.argv[3] if len(sys.argv)>3 else "trf"
+    parity(datafile, name, reference)
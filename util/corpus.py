@@ -0,0 +1,58 @@
+#! /usr/bin/python3
+
+# Streaming reader for DDI corpus XML files. Sentences are yielded one by
+# one as lightweight records, and parsed XML elements are discarded as soon
+# as they have been read, so memory use does not grow with the file size.
+
+import sys
+from collections import namedtuple
+from xml.etree.ElementTree import iterparse
+
+Sentence = namedtuple("Sentence", ["id", "text", "entities", "pairs"])
+Entity = namedtuple("Entity", ["id", "offset", "type", "text"])
+Pair = namedtuple("Pair", ["id", "e1", "e2", "ddi", "type"])
+
+
+## --------------------------------------------------
+## iterate over the sentences in given XML file
+## --------------------------------------------------
+def read_sentences(datafile) :
+    entities = []
+    pairs = []
+    root = None
+    for event, elem in iterparse(datafile, events=("start", "end")) :
+        if root is None :
+            root = elem
+            continue
+        if event == "start" : continue
+
+        if elem.tag == "entity" :
+            entities.append(Entity(elem.get("id"), elem.get("charOffset"),
+                                   elem.get("type"), elem.get("text")))
+        elif elem.tag == "pair" :
+            pairs.append(Pair(elem.get("id"), elem.get("e1"), elem.get("e2"),
+                              elem.get("ddi"), elem.get("type")))
+        elif elem.tag == "sentence" :
+            yield Sentence(elem.get("id"), elem.get("text"), entities, pairs)
+            entities = []
+            pairs = []
+            elem.clear()
+        elif elem.tag == "document" :
+            # drop finished documents (and their empty sentence elements)
+            root.clear()
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  corpus.py datafile
+## --
+## -- Prints number of sentences, entities and pairs in datafile
+## --
+
+if __name__ == "__main__" :
+    nsent = nent = npair = 0
+    for s in read_sentences(sys.argv[1]) :
+        nsent += 1
+        nent += len(s.entities)
+        npair += len(s.pairs)
+    print(f"{nsent} sentences, {nent} entities, {npair} pairs")
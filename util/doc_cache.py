@@ -0,0 +1,139 @@
+#! /usr/bin/python3
+
+# Persistent cache of sentences analyzed with spacy. Analyzed sentences are
+# stored as spacy DocBin shards, keyed by a hash of the sentence text, so
+# they are only analyzed once for a given model name and version.
+#
+# Cache layout:   cachedir/<analyzer>-<version>/<xx>.spacy
+# where <xx> are the first two hex digits of the sentence key.
+
+import sys, os
+import time
+import hashlib
+from contextlib import contextmanager
+
+from analyzer import SpacyAnalyzer, SPACY_MODELS
+
+
+## --------------------------------------------------
+## get version of the spacy package providing given model
+## --------------------------------------------------
+def model_version(model) :
+    import spacy
+    if model.startswith("blank:") :
+        # blank pipelines only depend on spacy tokenizer rules
+        return spacy.__version__
+    version = spacy.util.get_package_version(model)
+    return version if version is not None else "unknown"
+
+
+## --------------------------------------------------
+## hold a lock on a shard file while it is rewritten, so several
+## processes can add sentences to the same cache. A lock older than
+## 'stale' seconds is assumed to belong to a crashed process.
+## --------------------------------------------------
+@contextmanager
+def _locked(fname, stale=120) :
+    lockfile = fname+".lock"
+    while True :
+        try :
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError :
+            try :
+                if time.time() - os.path.getmtime(lockfile) > stale : os.remove(lockfile)
+            except OSError :
+                pass
+            time.sleep(0.05)
+    try :
+        yield
+    finally :
+        os.close(fd)
+        os.remove(lockfile)
+
+
+class CachedAnalyzer :
+
+    ## --------------------------------------------------
+    ## Constructor: locate cache for the given analyzer
+    ## --------------------------------------------------
+    def __init__(self, name, cachedir) :
+        self.name = name
+        self.model = SPACY_MODELS[name]
+        self.version = model_version(self.model)
+        self.cachedir = os.path.join(cachedir, f"{name}-{self.version}")
+        # the analyzer is only loaded if some sentence is not in the cache
+        self.analyzer = None
+        self.vocab = None
+        # loaded shards, shard id -> {key: doc}
+        self.shards = {}
+
+    ## ------ key of a sentence in the cache
+    def key(self, text) :
+        return hashlib.sha1(f"{self.model}|{self.version}|{text}".encode("utf-8")).hexdigest()
+
+    ## ------ load a shard file, if not loaded yet
+    def shard(self, sh) :
+        if sh not in self.shards :
+            from spacy.tokens import DocBin
+            from spacy.vocab import Vocab
+
+            self.shards[sh] = {}
+            fname = os.path.join(self.cachedir, sh+".spacy")
+            if os.path.exists(fname) :
+                if self.vocab is None : self.vocab = Vocab()
+                for doc in DocBin().from_disk(fname).get_docs(self.vocab) :
+                    self.shards[sh][doc.user_data["cache_key"]] = doc
+        return self.shards[sh]
+
+    ## ------ store new docs in their shards, and save them to disk
+    def store(self, docs) :
+        from spacy.tokens import DocBin
+        from spacy.vocab import Vocab
+
+        os.makedirs(self.cachedir, exist_ok=True)
+        if self.vocab is None : self.vocab = Vocab()
+        changed = set()
+        for key,doc in docs.items() :
+            doc.user_data["cache_key"] = key
+            self.shard(key[:2])[key] = doc
+            changed.add(key[:2])
+
+        for sh in changed :
+            fname = os.path.join(self.cachedir, sh+".spacy")
+            with _locked(fname) :
+                # other processes may have added sentences to the shard
+                # since it was loaded, keep them too
+                if os.path.exists(fname) :
+                    for doc in DocBin().from_disk(fname).get_docs(self.vocab) :
+                        self.shards[sh].setdefault(doc.user_data["cache_key"], doc)
+
+                db = DocBin(store_user_data=True)
+                for doc in self.shards[sh].values() :
+                    db.add(doc)
+                # write to a temporary file first, so an interrupted run
+                # does not leave a corrupted shard
+                db.to_disk(fname+".tmp")
+                os.replace(fname+".tmp", fname)
+
+    ## ------ analyze given texts, reading from cache those already seen
+    def pipe(self, texts, batch_size=64, n_process=1) :
+        texts = list(texts)
+        keys = [self.key(t) for t in texts]
+        docs = [self.shard(k[:2]).get(k) for k in keys]
+        hits = sum(doc is not None for doc in docs)
+
+        # analyze each missing sentence only once
+        missing = {}
+        for i,doc in enumerate(docs) :
+            if doc is None and keys[i] not in missing : missing[keys[i]] = texts[i]
+
+        if missing :
+            if self.analyzer is None : self.analyzer = SpacyAnalyzer(self.name)
+            new = dict(zip(missing.keys(),
+                           self.analyzer.pipe(missing.values(), batch_size=batch_size, n_process=n_process)))
+            self.store(new)
+            docs = [doc if doc is not None else new[k] for doc,k in zip(docs,keys)]
+
+        print(f"{hits} sentences read from cache, {len(missing)} analyzed", file=sys.stderr)
+        return docs
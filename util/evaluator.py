@@ -3,7 +3,7 @@
 import sys
 from os import listdir
 
-from xml.dom.minidom import parse
+from corpus import read_sentences
 
 ## --
 ## -- auxliary to insert an instance in given instance_set
@@ -23,20 +23,12 @@ def add_instance(instance_set, einfo, etype) :
 def load_gold_NER(goldfile) :
     entities = { "CLASS" : set([]), "NOCLASS" : set([]) }
 
-    # parse XML file, obtaining a DOM tree
-    tree = parse(goldfile)
-
     # process each sentence in the file
-    sentences = tree.getElementsByTagName("sentence")
-    for s in sentences :
-        sid = s.attributes["id"].value   # get sentence id
-
+    for s in read_sentences(goldfile) :
         # load sentence entities
-        ents = s.getElementsByTagName("entity")
-        for e in ents :
-            einfo = sid + "|" + e.attributes["charOffset"].value  + "|" + e.attributes["text"].value
-            etype = e.attributes["type"].value
-            add_instance(entities, einfo, etype)
+        for e in s.entities :
+            einfo = s.id + "|" + e.offset  + "|" + e.text
+            add_instance(entities, einfo, e.type)
             
     return entities
 
@@ -47,25 +39,13 @@ def load_gold_NER(goldfile) :
 def load_gold_DDI(goldfile) :
     relations = { "CLASS" : set([]), "NOCLASS" : set([]) }
 
-    # parse XML file, obtaining a DOM tree
-    tree = parse(goldfile)
-
     # process each sentence in the file
-    sentences = tree.getElementsByTagName("sentence")
-    for s in sentences :
-        sid = s.attributes["id"].value   # get sentence id
-
+    for s in read_sentences(goldfile) :
         # load "pairs"  in the sentence, keep those with ddi=true
-        pairs = s.getElementsByTagName("pair")
-        for p in pairs:
-            id_e1 = p.attributes["e1"].value
-            id_e2 = p.attributes["e2"].value
-            ddi = p.attributes["ddi"].value
-
-            if (ddi == "true") :
-                rtype = p.attributes["type"].value
-                rinfo = sid + "|" + id_e1 + "|" +  id_e2
-                add_instance(relations, rinfo, rtype)
+        for p in s.pairs:
+            if (p.ddi == "true") :
+                rinfo = s.id + "|" + p.e1 + "|" +  p.e2
+                add_instance(relations, rinfo, p.type)
 
     return relations
 
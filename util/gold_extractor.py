@@ -4,40 +4,41 @@
 
 # May be useful to compare with your output or to perform data exploration
 import sys
-from xml.dom.minidom import parse
+from corpus import read_sentences
 
 class GoldExtractor() :
 
     def __init__(self, datafile) :
-       self.tree =  parse(datafile)   
+       # file is read (streamed) each time something is extracted
+       self.datafile = datafile
     
     def extract_NER(self, outfile) :
        if type(outfile)==str : outf = open(outfile, "w") 
        else : outf = outfile
        
-       entities = self.tree.getElementsByTagName("entity")
-       for e in entities :
-          sent_id = ".".join(e.attributes["id"].value.split(".")[:-1])
-          print(sent_id,
-                e.attributes["charOffset"].value,
-                e.attributes["text"].value,
-                e.attributes["type"].value,
-                sep="|",
-                file = outf)
+       for s in read_sentences(self.datafile) :
+          for e in s.entities :
+             sent_id = ".".join(e.id.split(".")[:-1])
+             print(sent_id,
+                   e.offset,
+                   e.text,
+                   e.type,
+                   sep="|",
+                   file = outf)
        
        if type(outfile)==str : outf.close()
         
     def extract_DDI(self, outfile) :
        if type(outfile)==str : outf = open(outfile, "w") 
        else : outf = outfile
-       pairs = self.tree.getElementsByTagName("pair")
-       for p in pairs :
-           if (p.attributes["ddi"].value=="true") :
-               print(p.attributes["e1"].value,
-                     p.attributes["e2"].value,
-                     p.attributes["type"].value,
-                     sep="|",
-                     file = outf)
+       for s in read_sentences(self.datafile) :
+           for p in s.pairs :
+               if (p.ddi=="true") :
+                   print(p.e1,
+                         p.e2,
+                         p.type,
+                         sep="|",
+                         file = outf)
        
        if type(outfile)==str : outf.close()
 
@@ -0,0 +1,127 @@
+#! /usr/bin/python3
+
+# Stage timers for the experiment scripts. Code wraps each step of the
+# process in a stage:
+#
+#     with profiler.stage("analysis") :
+#         ...
+#
+# Stages may be nested. When profiling is not enabled, stages do nothing.
+# When it is, the time spent in each stage is accumulated, and report()
+# prints a breakdown per stage. If a directory is given to enable(), each
+# outermost stage is also run under cProfile, and report() saves its
+# statistics to DIR/<stage>.prof (can be loaded with pstats, snakeviz, ...)
+
+import sys, os
+import re
+import time
+import cProfile
+from contextlib import contextmanager, nullcontext
+
+_enabled = False
+_profdir = None
+_start = None
+# stage path (tuple of names) -> [calls, seconds], in order of first use
+_stats = {}
+# currently open stages
+_path = ()
+# cProfile statistics of each outermost stage, accumulated over calls
+_profiles = {}
+
+
+## --------------------------------------------------
+## start collecting stage times. If profdir is given, outermost
+## stages are also profiled with cProfile
+## --------------------------------------------------
+def enable(profdir=None) :
+    global _enabled, _profdir, _start
+    _enabled = True
+    _profdir = profdir
+    _start = time.perf_counter()
+    if profdir : os.makedirs(profdir, exist_ok=True)
+
+
+## ------ whether stage times are being collected
+def enabled() :
+    return _enabled
+
+
+## --------------------------------------------------
+## enable profiling according to a --profile[=DIR] command line
+## option, given the dict of options parsed by the script
+## --------------------------------------------------
+def enable_from_options(options) :
+    if "profile" in options :
+        enable(options["profile"] or None)
+
+
+## --------------------------------------------------
+## time the code inside a with block as the given stage
+## --------------------------------------------------
+def stage(name) :
+    if not _enabled : return nullcontext()
+    return _timed(name)
+
+@contextmanager
+def _timed(name) :
+    global _path
+    parent = _path
+    _path = parent + (name,)
+    entry = _stats.setdefault(_path, [0, 0.0])
+
+    prof = None
+    if _profdir and not parent :
+        prof = _profiles.setdefault(name, cProfile.Profile())
+        prof.enable()
+
+    start = time.perf_counter()
+    try :
+        yield
+    finally :
+        entry[0] += 1
+        entry[1] += time.perf_counter() - start
+        if prof is not None : prof.disable()
+        _path = parent
+
+
+## --------------------------------------------------
+## iterate over given iterable, timing the production of each
+## element as the given stage (e.g. for lazy generators)
+## --------------------------------------------------
+def timed_iter(name, iterable) :
+    if not _enabled : return iterable
+    return _timed_iter(name, iterable)
+
+def _timed_iter(name, iterable) :
+    it = iter(iterable)
+    while True :
+        with stage(name) :
+            try :
+                x = next(it)
+            except StopIteration :
+                return
+        yield x
+
+
+## --------------------------------------------------
+## print time spent in each stage. If profiling to a directory,
+## also write the breakdown to DIR/stages.txt, and the cProfile
+## statistics of each outermost stage to DIR/<stage>.prof
+## --------------------------------------------------
+def report(file=sys.stderr) :
+    if not _enabled : return
+    total = time.perf_counter() - _start
+
+    lines = [f"{'stage':<40} {'calls':>8} {'seconds':>10} {'%':>6}"]
+    for path,(calls,secs) in _stats.items() :
+        label = "  "*(len(path)-1) + path[-1]
+        lines.append(f"{label:<40} {calls:>8} {secs:>10.3f} {100*secs/total:>6.1f}")
+    lines.append(f"{'total':<40} {'':>8} {total:>10.3f} {100.0:>6.1f}")
+
+    print("\n".join(lines), file=file)
+    if _profdir :
+        with open(os.path.join(_profdir, "stages.txt"), "w") as sf :
+            print("\n".join(lines), file=sf)
+        for name,prof in _profiles.items() :
+            fname = re.sub(r"[^\w.-]+", "_", name) + ".prof"
+            prof.dump_stats(os.path.join(_profdir, fname))